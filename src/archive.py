@@ -14,6 +14,7 @@ import db_conn
 import importlib
 import glob
 import pdb
+from concurrent.futures import ProcessPoolExecutor
 import dep
 import instrument
 
@@ -40,20 +41,22 @@ def main():
     parser.add_argument('--confirm', dest="confirm", default=False, action="store_true", help='Confirm query results.')
     parser.add_argument('--transfer', default=False, action='store_true', help='Transfer to IPAC and trigger IPAC API.  Else, create files only.')
     parser.add_argument('--level', type=int, default=0, help='Data reduction level. Only needed if reprocessing by query search.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of records to reprocess at once (in separate processes) with a query.  Files are always processed one at a time.')
     args = parser.parse_args()    
 
     #run it 
     archive = Archive(args.instr, filepath=args.filepath, files=args.files, dbid=args.dbid, 
               reprocess=args.reprocess, starttime=args.starttime, endtime=args.endtime,
               status=args.status, statuscode=args.statuscode, ofname=args.ofname,
-              progid=args.progid, confirm=args.confirm, transfer=args.transfer, level=args.level)
+              progid=args.progid, confirm=args.confirm, transfer=args.transfer, level=args.level,
+              workers=args.workers)
 
 
 class Archive():
 
     def __init__(self, instr, filepath=None, files=None, dbid=None, reprocess=False, 
                  starttime=None, endtime=None, status=None, statuscode=None,
-                 ofname=None, progid=None, confirm=False, transfer=False, level=0):
+                 ofname=None, progid=None, confirm=False, transfer=False, level=0, workers=1):
 
         #inputs
         self.instr = instr.upper()
@@ -70,6 +73,7 @@ class Archive():
         self.confirm = confirm
         self.transfer = transfer
         self.level = level
+        self.workers = workers
 
         #other class vars
         self.db = None
@@ -119,17 +123,38 @@ class Archive():
 
     def process_file(self, filepath=None, dbid=None):
         '''Creates instrument object by name and starts processing.'''
-        module = importlib.import_module('instr_' + self.instr.lower())
-        instr_class = getattr(module, self.instr.capitalize())
-        instr_obj = instr_class(self.instr, filepath, self.reprocess,
-                                self.transfer, self.progid, dbid=dbid)
-
-        ok = instr_obj.process()
-        if not ok:
-            #NOTE: DEP has its own error reporting system so no need to do anything here.
-            print("DEP finished with ERRORS!  See log file for details.")
-        else:
-            print("DEP finished successfully.")
+        process_file(self.instr, filepath, dbid, self.reprocess, self.transfer, self.progid)
+
+
+    def process_file_list(self, filepaths=(), dbids=()):
+        '''
+        Process each file or database record.  With more than one worker, the database
+        records are processed in parallel in separate processes (each one runs a separate DEP).
+        NOTE: Files are always processed one at a time.  DEP inserts the koa_status record of a
+        new file and checks its KOAID for duplicates with separate queries, so parallel runs could
+        race (e.g. two files with the same KOAID both passing the duplicate check).  Records from
+        a query already have their koa_status entry and are safe to run in parallel.
+        '''
+        if filepaths and self.workers > 1:
+            print("NOTE: --workers is only used for query reprocessing.  Processing files one at a time.")
+        for filepath in filepaths:
+            self.process_file(filepath=filepath)
+
+        if self.workers <= 1:
+            for dbid in dbids:
+                self.process_file(dbid=dbid)
+            return
+
+        #a failed record is reported and does not stop the others
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(process_file, self.instr, None, dbid, self.reprocess,
+                                       self.transfer, self.progid): dbid
+                       for dbid in dbids}
+            for future, dbid in futures.items():
+                try:
+                    future.result()
+                except Exception as error:
+                    email_error('ARCHIVE_ERROR', f'DB ID {dbid}\n{traceback.format_exc()}', self.instr)
 
 
     def process_files(self, pattern):
@@ -147,8 +172,7 @@ class Archive():
             print("--------------------")
             print(f"{len(files)} files found.  Use --confirm option to process these files.\n")
         else:
-            for f in files:
-                self.process_file(filepath=f)
+            self.process_file_list(filepaths=files)
 
 
 
@@ -180,8 +204,29 @@ class Archive():
             print("--------------------")
             print(f"{len(rows)} records found.  Use --confirm option to process these records.\n")
         else:
-            for row in rows:
-                self.process_file(dbid=row['id'])
+            self.process_file_list(dbids=[row['id'] for row in rows])
+
+
+def process_file(instr, filepath, dbid, reprocess, transfer, progid):
+    '''
+    Creates instrument object by name and starts processing.
+    Module level so it can be run in a worker process.
+    '''
+    module = importlib.import_module('instr_' + instr.lower())
+    instr_class = getattr(module, instr.capitalize())
+    instr_obj = instr_class(instr, filepath, reprocess, transfer, progid, dbid=dbid)
+
+    ok = instr_obj.process()
+    if not ok:
+        #NOTE: DEP has its own error reporting system so no need to do anything here.
+        print("DEP finished with ERRORS!  See log file for details.")
+    else:
+        print("DEP finished successfully.")
+
+    #close the fits file now rather than whenever the object is collected
+    if instr_obj.fits_hdu:
+        instr_obj.fits_hdu.close()
+    return ok
 
 
 def email_error(errcode, text, instr='', check_time=True):
@@ -2,19 +2,66 @@
 This is the class to handle all the HIRES specific attributes
 """
 import os
+import re
 import glob
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import instrument
 from common import *
 import numpy as np
 from astropy.io import fits
-from astropy.visualization import (SqrtStretch, ImageNormalize, ZScaleInterval)
-from datetime import datetime
-import matplotlib.pyplot as plt
+from astropy.visualization import ZScaleInterval
+from datetime import date, datetime
+from PIL import Image
+
+# fitsio (cfitsio) reads the multi-extension KPF files much faster than
+# astropy,  fall back to astropy if it is not installed.
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
 
 import logging
 log = logging.getLogger('koa_dep')
 
+# maximum size (pixels per side) of the JPG previews,  larger detector mosaics
+# are block averaged down to this size before writing the JPGs
+JPG_MAX_SIZE = 1024
+
+# libjpeg quality of the JPG previews
+JPG_QUALITY = 85
+
+# KOAID format OFNAME: KP.<YYYYMMDD>.<int*5>.<int*2>[.fits]
+KOAID_RE = re.compile(r'KP\.(\d{8})\.(\d{5})\.(\d{2})(?:\.fits)?$')
+
+# lower case EXTNAME prefixes of the detector data extensions
+KPF_EXT_PREFIXES = ('red', 'green', 'ca_hk')
+
+# paths to all the KPF accounts (kpf1-9),  including engineering and development
+KPF_DIR_LIST = tuple(
+    f'/s/sdata170{indx1}/kpf{account}'
+    for indx1 in range(1, 10)
+    for account in [*map(str, range(1, 10)), 'eng', 'dev']
+)
+
+
+@lru_cache(maxsize=4096)
+def _valid_yyyymmdd(yyyymmdd):
+    """
+    Check that a YYYYMMDD string is a real calendar date.  Cached since
+    files from the same night share the date.
+
+    :param yyyymmdd: <str> the date string
+    :return: <bool> True if the date is valid
+    """
+    try:
+        date(int(yyyymmdd[0:4]), int(yyyymmdd[4:6]), int(yyyymmdd[6:8]))
+    except ValueError:
+        return False
+
+    return True
+
 
 class Kpf(instrument.Instrument):
 
@@ -70,50 +117,33 @@ class Kpf(instrument.Instrument):
         """
         ofname = self.get_keyword('OFNAME', useMap=False)
         if ofname:
-            koaid = f"KP.{ofname.split('KP.')[-1].rstrip('.fits')}"
-            if not self._validate_koaid(koaid):
+            match = KOAID_RE.search(ofname.strip())
+            if not match or not self._validate_koaid(match.group(1)):
                 return False
 
             self.set_utc()
-            return koaid
+            return 'KP.' + '.'.join(match.groups())
 
         return super().make_koaid()
 
-    def _validate_koaid(self, koaid):
+    def _validate_koaid(self, koaid_date):
         """
-        Check that the KOAID from OFNAME,  is a valid KOAID.  Assumes KP.
-        are the first three characters of koaid string.
+        Check that the date of the KOAID from OFNAME is valid.  The format,
+        KP.<YYYYMMDD>.<int*5>.<int*2>, is already enforced by KOAID_RE.
 
-        :param koaid: <str> koaid format KP.<YYYYMMDD>.<int*5>.<int*2>
-        :return:
+        :param koaid_date: <str> the YYYYMMDD part of the koaid
+        :return: <bool> True if the date is valid
         """
-        # check that the format has 4 parts delimited by decimals
-        koaid_parts = koaid.split('.')
-        if len(koaid_parts) != 4:
-            return False
-
         # check that the KOAID date matches the date of DATE-OBS Header Key.
         date_obs = self.get_keyword('DATE-OBS', useMap=False)
         if not date_obs:
             return False
 
-        koaid_date = koaid_parts[1]
         if date_obs.replace('-', '') != koaid_date:
             return False
 
-        # check that parts are:  date, int, int -- part 0 was added as KP
-        try:
-            datetime.strptime(koaid_parts[1], '%Y%m%d')
-            int(koaid_parts[2])
-            int(koaid_parts[3])
-        except ValueError:
-            return False
-
-        # check that the length of the integer parts are correct.
-        if len(koaid_parts[2]) != 5 or len(koaid_parts[3]) != 2:
-            return False
-
-        return True
+        # check that the date is a real calendar date
+        return _valid_yyyymmdd(koaid_date)
 
     def set_inst(self):
         """
@@ -298,23 +328,7 @@ class Kpf(instrument.Instrument):
 
         :return: Returns the list of paths
         """
-        direct_list = []
-        base_path = '/s/sdata17'
-        for indx1 in range(1, 10):
-            base_kpf_path = f'{base_path}0{indx1}/kpf'
-            for indx2 in range(1, 10):
-                full_path = f'{base_kpf_path}{indx2}'
-                direct_list.append(full_path)
-
-            # engineering path
-            full_path = f'{base_kpf_path}eng'
-            direct_list.append(full_path)
-
-            # development path
-            full_path = f'{base_kpf_path}dev'
-            direct_list.append(full_path)
-
-        return direct_list
+        return list(KPF_DIR_LIST)
 
     def get_prefix(self):
         """
@@ -322,7 +336,7 @@ class Kpf(instrument.Instrument):
 
         :return: <str>
         """
-        instr = self.get_keyword('INSTRUME')
+        instr = self.get_keyword('INSTRUME') or ''
         if 'kpf' in instr.lower():
             prefix = 'KP'
         else:
@@ -342,26 +356,41 @@ class Kpf(instrument.Instrument):
         Basic convert fits primary data to jpg.  Instrument subclasses
         can override this function.
         """
-        # get image data
-        hdu = fits.open(fits_filepath, ignore_missing_end=True)
-        img_data = {'red': np.array([]), 'green': np.array([]),
-                    'ca_hk': np.array([])}
-
-        ext_names = list(img_data.keys())
+        # get image data,  astropy only pages in the extensions that are read.
+        # memmap is left at its default: the raw amps are BZERO scaled, which
+        # an explicit memmap=True refuses to load.
+        if fitsio is not None:
+            hdu = fitsio.FITS(fits_filepath)
+        else:
+            hdu = fits.open(fits_filepath, ignore_missing_end=True,
+                            lazy_load_hdus=True)
 
-        # get dict with number of extensions per array
-        ext_lengths = self._calc_ext_lengths(hdu, ext_names)
+        with hdu:
+            img_data = {name: np.array([]) for name in KPF_EXT_PREFIXES}
+            ext_names = KPF_EXT_PREFIXES
 
-        # order the extension data
-        ext_combination = self._create_order(hdu, ext_names, ext_lengths)
+            # collect the amp data per array and order it
+            ext_data = self._scan_extensions(hdu, ext_names)
+            ext_combination = self._create_order(ext_data)
 
         # get data into the right places
         img_data = self._mosaic_data(img_data, ext_combination)
         basename = os.path.basename(fits_filepath).replace('.fits', '')
 
-        # form filepaths
-        for extn in ext_names:
-            self._write_img(img_data, extn, basename, outdir)
+        # stretch and write the JPGs in parallel,  numpy and the libjpeg
+        # encoder both release the GIL
+        extns = [extn for extn in ext_names
+                 if img_data[extn] is not None and img_data[extn].size > 0]
+        if not extns:
+            return
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            with ThreadPoolExecutor(max_workers=len(extns)) as executor:
+                list(executor.map(
+                    lambda extn: self._write_img(img_data, extn, basename,
+                                                 outdir),
+                    extns))
 
     # TODO define ENG for daytime cals
     def has_target_info(self):
@@ -378,81 +407,92 @@ class Kpf(instrument.Instrument):
     # JPG writing functions
     # ---------------------
     @staticmethod
-    def _check_extension(hdr, ext_names):
+    def _read_header(hdu, indx):
         """
-        Confirm that the extension exists in the fits file.
+        Read the header of an extension from either a fitsio or astropy file.
 
-        :param hdr: the image header object
-        :param ext_names: <list> the different data exetension names.
+        :param hdu: the fitsio.FITS or astropy.io HDUList object
+        :param indx: <int> the extension index
 
-        :return: <bool> True if the extension name is found in the header
+        :return: the extension header
         """
-        try:
-            ext_name = hdr['EXTNAME'].lower()
-            for n_ext in ext_names:
-                if n_ext in ext_name:
-                    return True
-        except KeyError:
-            return False
+        if fitsio is not None and isinstance(hdu, fitsio.FITS):
+            return hdu[indx].read_header()
 
-        return False
+        return hdu[indx].header
 
-    def _calc_ext_lengths(self, hdu, ext_names):
+    @staticmethod
+    def _read_data(hdu, indx):
         """
-        Determine the number of extension per array in order to mosaic the
-        different amplifiers together.
+        Read the pixel data of an extension from either a fitsio or astropy
+        file.
 
-        :param hdu: The astropy.io data
-        :param ext_names: <list> the different data exetension names.
-        :return:
+        :param hdu: the fitsio.FITS or astropy.io HDUList object
+        :param indx: <int> the extension index
+
+        :return: <numpy array> the extension pixel data
+        """
+        if fitsio is not None and isinstance(hdu, fitsio.FITS):
+            return hdu[indx].read()
+
+        return hdu[indx].data
+
+    @staticmethod
+    def _check_extension(ext_name, ext_names):
+        """
+        Confirm that the extension is one of the data extensions.
+
+        :param ext_name: <str> the lower case EXTNAME
+        :param ext_names: <tuple> the lower case data extension name prefixes.
+
+        :return: <bool> True if the extension name is a data extension
+        """
+        return ext_name.startswith(ext_names)
+
+    def _scan_extensions(self, hdu, ext_names):
+        """
+        Single pass over the extensions to collect the amplifier data for
+        each array (detector).
+
+        :param hdu: The fitsio or astropy.io data
+        :param ext_names: <tuple> the lower case data extension names.
+        :return: <dict> {data_key: {amp index: numpy array}}
         """
-        ext_lengths = {}
+        ext_data = {}
 
         for indx in range(0, len(hdu)):
-            hdr = hdu[indx].header
-            if not self._check_extension(hdr, ext_names):
+            hdr = self._read_header(hdu, indx)
+            ext_name = hdr.get('EXTNAME')
+            if not ext_name:
                 continue
 
-            dataname_split = hdr['EXTNAME'].lower().split('_amp')
-            data_key = dataname_split[0]
-            if len(dataname_split) > 1:
-                data_suffix = int(dataname_split[-1][-1])
+            ext_name = ext_name.lower()
+            if not self._check_extension(ext_name, ext_names):
+                continue
+
+            data_key, _, amp = ext_name.partition('_amp')
+            if amp:
+                data_suffix = int(amp[-1]) - 1
             else:
-                data_suffix = 1
+                data_suffix = 0
 
-            if data_key not in ext_lengths or data_suffix > ext_lengths[data_key]:
-                ext_lengths[data_key] = data_suffix
+            ext_data.setdefault(data_key, {})[data_suffix] = \
+                self._read_data(hdu, indx)
 
-        return ext_lengths
+        return ext_data
 
-    def _create_order(self, hdu, ext_names, ext_lengths):
+    @staticmethod
+    def _create_order(ext_data):
         """
         Organize the extensions so that the mosiac adds them by the extension
         order.
 
-        :param hdu: The astropy.io data
-        :param ext_names: <list> the different data exetension names.
-        :param ext_lengths: <dict> the number of extension per image (detector).
-        :return:
+        :param ext_data: <dict> the amp data per array from _scan_extensions.
+        :return: <dict - list> the amp data per array,  in amp order.
         """
         ext_combo = {}
-
-        for indx in range(0, len(hdu)):
-            hdr = hdu[indx].header
-            if self._check_extension(hdr, ext_names):
-                dataname_split = hdr['EXTNAME'].lower().split('_amp')
-                data_key = dataname_split[0]
-
-                if len(dataname_split) > 1:
-                    data_suffix = int(dataname_split[-1][-1]) - 1
-                else:
-                    data_suffix = 0
-
-                if data_key in ext_combo:
-                    ext_combo[data_key][data_suffix] = hdu[indx].data
-                else:
-                    ext_combo[data_key] = [None] * ext_lengths[data_key]
-                    ext_combo[data_key][data_suffix] = hdu[indx].data
+        for data_key, amps in ext_data.items():
+            ext_combo[data_key] = [amps.get(i) for i in range(max(amps) + 1)]
 
         return ext_combo
 
@@ -468,21 +508,110 @@ class Kpf(instrument.Instrument):
         """
         for data_key, hdu_data in ext_combo.items():
             if len(hdu_data) > 2:
+                # 2x2 amps,  copy each quadrant straight into the mosaic
+                nrows, ncols = hdu_data[0].shape
+                mosaic = np.empty((2 * nrows, 2 * ncols),
+                                  dtype=np.result_type(*hdu_data))
+                mosaic[:nrows, :ncols] = hdu_data[0]
+                mosaic[:nrows, ncols:] = hdu_data[1]
+                mosaic[nrows:, :ncols] = hdu_data[2]
                 if len(hdu_data) == 3:
-                    hdu_data.append(np.zeros(hdu_data[-1].shape))
-                img_data[data_key] = np.vstack(
-                    (np.hstack((hdu_data[0], hdu_data[1])),
-                     np.hstack((hdu_data[2], hdu_data[3]))))
+                    mosaic[nrows:, ncols:] = 0
+                else:
+                    mosaic[nrows:, ncols:] = hdu_data[3]
+                img_data[data_key] = mosaic
+            elif len(hdu_data) == 1:
+                img_data[data_key] = hdu_data[0]
             else:
+                # amps side by side,  copy each into its columns of the mosaic
+                ncols = sum(ext_data.shape[1] for ext_data in hdu_data)
+                mosaic = np.empty((hdu_data[0].shape[0], ncols),
+                                  dtype=np.result_type(*hdu_data))
+                col = 0
                 for ext_data in hdu_data:
-                    if img_data[data_key].size == 0:
-                        img_data[data_key] = ext_data
-                    else:
-                        img_data[data_key] = np.hstack(
-                            (img_data[data_key], ext_data))
+                    mosaic[:, col:col + ext_data.shape[1]] = ext_data
+                    col += ext_data.shape[1]
+                img_data[data_key] = mosaic
 
         return img_data
 
+    @staticmethod
+    def _downsample(idata, max_size):
+        """
+        Block average the image by the smallest integer factor that brings
+        it within max_size pixels per side.  Rows / columns that do not fill a
+        complete block are trimmed from the edges.
+
+        :param idata: <numpy array> the image pixel data
+        :param max_size: <int> the maximum number of pixels per side
+
+        :return: <numpy array> the downsampled image
+        """
+        # never reduce the short side to zero pixels
+        factor = min(-(-max(idata.shape) // max_size), min(idata.shape))
+        if factor <= 1:
+            return idata
+
+        nrows = idata.shape[0] // factor
+        ncols = idata.shape[1] // factor
+        trimmed = idata[:nrows * factor, :ncols * factor]
+
+        # accumulate in float32,  the default for integer data is float64
+        return trimmed.reshape(nrows, factor, ncols, factor).mean(
+            axis=(1, 3), dtype=np.float32)
+
+    @staticmethod
+    def _convert_to_uint8(idata):
+        """
+        ZScale and square root stretch the image into 8 bit grayscale.  The
+        scaling is done in place on a single float32 work array rather than
+        through ImageNormalize,  which creates a new full size array for each
+        step.  Integer images of 16 bits or less go through a lookup table.
+
+        :param idata: <numpy array> the image pixel data
+
+        :return: <numpy uint8 array> the stretched image
+        """
+        idata = Kpf._downsample(idata, JPG_MAX_SIZE)
+
+        vmin, vmax = ZScaleInterval().get_limits(idata)
+        scale = np.float32(1.0 / (vmax - vmin) if vmax > vmin else 1.0)
+
+        # 8/16 bit integer data has at most 65536 distinct values,  stretch
+        # each value once and map the pixels through the lookup table.
+        if idata.dtype.kind in 'iu' and idata.dtype.itemsize <= 2:
+            utype = np.dtype(f'u{idata.dtype.itemsize}').newbyteorder(
+                idata.dtype.byteorder)
+            levels = np.arange(2 ** (8 * utype.itemsize), dtype=utype)
+            lut = Kpf._stretch(levels.view(idata.dtype), vmin, scale)
+
+            return lut[idata.view(utype)]
+
+        return Kpf._stretch(idata, vmin, scale)
+
+    @staticmethod
+    def _stretch(idata, vmin, scale):
+        """
+        Square root stretch the values into 8 bits using a single float32
+        work array.
+
+        :param idata: <numpy array> the values to stretch
+        :param vmin: <float> the value mapped to 0
+        :param scale: <float32> 1 / (vmax - vmin)
+
+        :return: <numpy uint8 array> the stretched values
+        """
+        work = np.subtract(idata, vmin, dtype=np.float32)
+        work *= scale
+        np.clip(work, 0.0, 1.0, out=work)
+        np.sqrt(work, out=work)
+
+        # scale to 0-255 and truncate to uint8 in the same pass
+        out = np.empty(work.shape, dtype=np.uint8)
+        np.multiply(work, 255.0, out=out, casting='unsafe')
+
+        return out
+
     def _write_img(self, img_data, extn, basename, outdir):
         """
         Write a numpy array into a JPG file.
@@ -497,31 +626,13 @@ class Kpf(instrument.Instrument):
         if img_data[extn] is None or img_data[extn].size == 0:
             return
 
-        warnings.filterwarnings("ignore", category=RuntimeWarning)
-
-        idata = img_data[extn]
-
         jpg_filepath = f'{outdir}/{basename}_{extn.lower()}.jpg'
 
-        norm = ImageNormalize(idata, interval=ZScaleInterval(),
-                              stretch=SqrtStretch())
-
-        shape = idata.shape
-
-        # create jpg
-        dpi = 100
-        width_inches = shape[1] / dpi
-        height_inches = shape[0] / dpi
-        fig = plt.figure(figsize=(width_inches, height_inches), frameon=False,
-                         dpi=dpi)
-
-        plt.axis('off')
-        ax = fig.add_axes([0, 0, 1, 1])
-        plt.imshow(idata, origin='lower', norm=norm, cmap='gray')
-        plt.savefig(jpg_filepath)
-        plt.close()
+        idata = self._convert_to_uint8(img_data[extn])
 
-        warnings.filterwarnings("default", category=RuntimeWarning)
+        # create jpg,  flip the rows so row 0 is at the bottom (origin lower)
+        Image.fromarray(idata[::-1]).save(jpg_filepath, format='JPEG',
+                                          quality=JPG_QUALITY, optimize=False)
 
     # beyond level 0 functions
     def copy_drp_files(self):
@@ -8,28 +8,195 @@ import instrument
 import datetime as dt
 import numpy as np
 import math
-from astropy.convolution import convolve,Box1DKernel
 from astropy.io import fits
 from astropy import units as u
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import Angle
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
+from astropy.visualization import ZScaleInterval, AsinhStretch
 from PIL import Image
-from astropy.visualization import ZScaleInterval, AsinhStretch, SinhStretch
-from astropy.visualization.mpl_normalize import ImageNormalize
-from mpl_toolkits.axes_grid1 import ImageGrid
 
-import hist_equal2d
-from skimage import exposure
+#row/column step of the pixels sampled for the blue JPG ZScale limits
+ZSCALE_STRIDE = 4
+
+#rows per block when counting saturated pixels (keeps the comparison mask cache sized)
+NPIXSAT_BLOCK_ROWS = 128
+
+#optional faster (introselect) row medians
+try:
+    import bottleneck as bn
+except ImportError:
+    bn = None
+
+#optional faster (cfitsio) header and pixel reads for the jpgs, astropy otherwise
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
 
 import logging
 
 log = logging.getLogger('koa_dep')
 
+#LRIS side (red or blue) by INSTRUME
+INSTRUME_SIDE = {'LRIS':      'red',
+                 'LRISp':     'red',
+                 'LRISpRED':  'red',
+                 'LRISBLUE':  'blue',
+                 'LRISpBLUE': 'blue'}
+
+#GRISNAME prefixes of the blue imaging (clear and narrow band) positions
+BLUE_IMAGING_GRISMS = ('cl', 'NB')
+
+#number of amplifiers by blue AMPLIST and red AMPMODE
+AMPLIST_NUMAMPS = {'1,0,0,0': 1,
+                   '2,0,0,0': 1,
+                   '2,1,0,0': 2,
+                   '1,3,0,0': 1,
+                   '2,4,0,0': 1,
+                   '1,4,0,0': 2}
+AMPMODE_NUMAMPS = (('SINGLE:L', 1),
+                   ('SINGLE:R', 1),
+                   ('DUAL:L+R', 2))
+
+#KOAIMTYP for the LAMPS values that fully determine it
+LAMPS_IMAGETYP = {'0,0,0,0,0,1': 'flatlamp',
+                  '0,0,0,0,0,0': 'dark'}
+
+#individual arc lamp keywords (used when LAMPS is missing)
+ARC_LAMP_KEYWORDS = ('NEON', 'ARGON', 'CADMIUM', 'ZINC', 'KRYPTON', 'XENON', 'FEARGON', 'DEUTERI')
+
+#CALNAME values of polarimetry calibrations
+POLCAL_NAMES = frozenset(('ir', 'hnpb', 'uv'))
+
+#AXESTAT values while on sky
+AXESTAT_ON_SKY = frozenset(('tracking', 'slewing'))
+
+#OBJECT values (lower case, no separators) of twilight flats
+TWIFLAT_NAMES = frozenset(('twiflat', 'twilightflat', 'skyflat'))
+
+#image extension HDU types (what the old 'ImageHDU' in str(type(hdu)) test matched)
+IMAGE_HDU_TYPES = (fits.ImageHDU, fits.CompImageHDU)
+
+#separators removed from OBJECT before the twilight flat check
+OBJECT_SEPARATORS = str.maketrans('', '', ' -_')
+
+#SLITNAME values without slit dimensions
+SLIT_DIMS_SKIP = frozenset(('GOH_LRIS', 'direct'))
+
+#imaging filter wavelength ranges [blue, red] (angstroms)
+RED_FILTER_WAVES = {'clear':(3500,9000),
+                    'B':(3800,5300),
+                    'V':(4800,6600),
+                    'R':(5500,8200),
+                    'Rs':(6000,7500),
+                    'I':(6800,8400),
+                    'GG495':(4800,4950),
+                    'OG570':(5500,5700),
+                    'RG850':(8200,8500),
+                    'NB4000':(3800,4200),
+                    'NB5390':(5350,5400),
+                    'NB6741':(6700,6800),
+                    'NB8185':(8150,8250),
+                    'NB8560':(8500,8650),
+                    'NB9135':(9100,9200),
+                    'NB9148':(9050,9250),
+                    'NB4325':(9050,9520)}
+BLUE_FILTER_WAVES = {'clear':(3000,6500),
+                     'U':(3050,4000),
+                     'B':(3900,4900),
+                     'V':(5800,6600),
+                     'G':(4100,5300),
+                     'SP580':(0,0),
+                     'NB4170':(0,0)}
+
+#red grating wavelength coverage (angstroms), centered on WAVELEN
+RED_GRATING_COVERAGE = {'150/7500':12288,
+                        '300/5000':6525,
+                        '400/8500':4762,
+                        '600/5000':3275,
+                        '600/7500':3275,
+                        '600/10000':3275,
+                        '831/8200':2375,
+                        '900/5500':2175,
+                        '1200/7500':1638,
+                        '1200/9000':1638}
+#gratings used before May 14th, 2015 (ISO date, compared as a string against DATE-OBS)
+NEW_GRATINGS_DATE = '2015-05-14'
+RED_GRATING_COVERAGE_OLD = {'150/7500':9830,
+                            '158/8500':9830,
+                            '300/5000':5220,
+                            '400/8500':3810,
+                            '600/5000':2620,
+                            '600/7500':2620,
+                            '600/10000':2620,
+                            '831/8200':1900,
+                            '900/5500':1740,
+                            '1200/7500':1310}
+
+#blue grism wavelength ranges [blue, red] (angstroms) for longslit and other masks
+BLUE_GRISM_WAVES_LONG = {'300/5000':(1570,7420),
+                         '400/3400':(1270,5740),
+                         '600/4000':(3010,5600),
+                         '1200/3400':(2910,3890)}
+BLUE_GRISM_WAVES = {'300/5000':(2210,8060),
+                    '400/3400':(1760,6220),
+                    '600/4000':(3300,5880),
+                    '1200/3400':(3010,4000)}
+
+#dichroic cutoff wavelength (angstroms) by DICHNAME (nanometers)
+DICHROIC_CUTOFF = {'460':4874,
+                   '500':5091,
+                   '560':5696,
+                   '680':6800}
+
+#filter keyword and wavelength ranges per side
+FILTER_SETUP = {'red':  ('REDFILT', RED_FILTER_WAVES),
+                'blue': ('BLUFILT', BLUE_FILTER_WAVES)}
+
+#pointing origin xim and yim
+POINTING_ORIGINS = {'REF':(380.865,71.44),
+                    'REFO':(-377.22,72.52),
+                    'LRIS':(3.97,-309.82),
+                    'slitb':(-14.41,-263.74),
+                    'slitc':(31.85,-262.58),
+                    'POL':(3.91,-273.12),
+                    'LRISB':(-53.11,-310.54),
+                    'PICKOFF':(27.95,-260.63),
+                    'MIRA':(3.67,-300.34),
+                    'BEDGE':(20.25,-260.68),
+                    'TEDGE':(-0.65,-263.68),
+                    'UNDEFINED':(-53.11,-320.54)}
+
+#DETSEC format: [x1:x2,y1:y2]
+DETSEC_RE = re.compile(r'(-?\d+):(-?\d+),(-?\d+):(-?\d+)')
+
+#slit [length, width] (arcsec)
+SLIT_DIMS = {'long_0.7':(175,0.7),
+             'long_1.0':(175,1.0),
+             'long_1.5':(175,1.5),
+             'long_8.7':(175,8.7),
+             'pol_1.0':(25,1.0),
+             'pol_1.5':(25,1.5)}
+
+#[dispersion, fwhm] for the red gratings and blue grisms
+RED_GRATING_RES = {'150/7500':(3.00,0),
+                   '300/5000':(0,9.18),
+                   '400/8500':(1.16,6.90),
+                   '600/5000':(0.80,4.70),
+                   '600/7500':(0.80,4.70),
+                   '600/10000':(0.80,4.70),
+                   '831/8200':(0.58,0),
+                   '900/5500':(0.53,0),
+                   '1200/7500':(0.40,0),
+                   '1200/9000':(0.40,0)}
+BLUE_GRISM_RES = {'300/5000':(1.43,8.80),
+                  '400/3400':(1.09,6.80),
+                  '600/4000':(0.63,3.95),
+                  '1200/3400':(0.24,1.56)}
+
 
 class Lris(instrument.Instrument):
 
@@ -39,6 +206,9 @@ class Lris(instrument.Instrument):
         # Set any unique keyword index values here
         self.keymap['OFNAME']   = 'OUTFILE'
 
+        # LRIS side of this file, set from INSTRUME on first use (see side)
+        self._side = None
+
         # Other vars that subclass can overwrite
         self.keyskips   = ['CCDGN00', 'CCDRN00']
         #self.keyskips = ['IM01MN00', 'IM01SD00', 'IM01MD00', 'PT01MN00', 'PT01SD00', 'PT01MD00', 'IM01MN01', 'IM01SD01', 'IM01MD01', 'PT01MN01', 'PT01SD01', 'PT01MD01', 'IM02MN02', 'IM02SD02', 'IM02MD02', 'PT02MN02', 'PT02SD02', 'PT02MD02', 'IM02MN03', 'IM02SD03', 'IM02MD03', 'PT02MN03', 'PT02SD03', 'PT02MD03']
@@ -87,13 +257,9 @@ class Lris(instrument.Instrument):
         #note: idl dep searches /s/sdata/2* , though it is known that the dirs are 241/242/243
         #note: There are subdirs /lris11/ thru /lris20/, though it is known that these are not used
         dirs = []
-        path = '/s/sdata24'
         for i in range(1,4):
-            path2 = path + str(i) + '/lris'
-            for i in range(1,10):
-                path3 = path2 + str(i)
-                dirs.append(path3)
-            dirs.append(path2 + 'eng')
+            dirs += [f'/s/sdata24{i}/lris{j}' for j in range(1,10)]
+            dirs.append(f'/s/sdata24{i}/lriseng')
         return dirs
 
 
@@ -159,12 +325,7 @@ class Lris(instrument.Instrument):
 
     def get_koaimtyp(self):
 
-        #if instrument not defined, return
         imagetyp = 'undefined'
-        try:
-            instrume = self.get_keyword('INSTRUME')
-        except:
-            return 'undefined'
 
         #focus
         slitname = self.get_keyword('SLITNAME')
@@ -182,8 +343,6 @@ class Lris(instrument.Instrument):
             trapdoor = self.get_keyword('TRAPDOOR')
         except:
             return 'undefined'
-        graname = self.get_keyword('GRANAME')
-        grisname = self.get_keyword('GRISNAME')
         if trapdoor == 'open':
             #is lamp on?
             flimagin = self.get_keyword('FLIMAGIN')
@@ -191,76 +350,67 @@ class Lris(instrument.Instrument):
             flat1 = self.get_keyword('FLAMP1')
             flat2 = self.get_keyword('FLAMP2')
             #a lamp is on
-            if 'on' in [flimagin,flspectr,flat1,flat2]:
+            if flimagin == 'on' or flspectr == 'on' or flat1 == 'on' or flat2 == 'on':
                 return 'flatlamp'
             else:
                 #no lamp on
                 # this is no longer working for red (autoshut/calname missing)
                 # axestat check works for most cases
-                axestat = self.get_keyword('AXESTAT', default='')
+                axestat = self.get_keyword('AXESTAT', default='').lower()
                 if self.get_keyword('AUTOSHUT'):
                     calname = self.get_keyword('CALNAME')
-                    if calname in ['ir','hnpb','uv']:
+                    if calname in POLCAL_NAMES:
                         return 'polcal'
                     else:
                         return 'object'
-                elif axestat.lower() in ['tracking', 'slewing']:
+                elif axestat in AXESTAT_ON_SKY:
                     return 'object'
-                elif axestat.lower() == 'in position':
+                elif axestat == 'in position':
                     objectVal = self.get_keyword('OBJECT', default='')
-                    for ch in [' ', '-', '_']:
-                        objectVal = objectVal.replace(ch, '')
-                    objectVal = objectVal.replace('flats', 'flat')
-                    if objectVal.lower() in ['twiflat', 'twilightflat', 'skyflat']:
+                    objectVal = objectVal.translate(OBJECT_SEPARATORS).replace('flats', 'flat')
+                    if objectVal.lower() in TWIFLAT_NAMES:
                         return 'object'
                 else:
                     return 'undefined'
         elif trapdoor == 'closed':
             #is lamp on?
             # lamps does not exist in lris red now, others do
+            graname = self.get_keyword('GRANAME')
+            grisname = self.get_keyword('GRISNAME')
             lamps = self.get_keyword('LAMPS')
-            if lamps not in ['','0',None]:
-                if '1' in lamps:
-                    if lamps == '0,0,0,0,0,1':
-                        return 'flatlamp'
-                    else:
-                        if self._is_red(instrume):
-                            if graname != 'mirror':
-                                return 'arclamp'
-                        elif self.is_blue(instrume):
-                            if grisname != 'clear':
-                                return 'arclamp'
-                else:
-                    if lamps == '0,0,0,0,0,0':
-                        return 'dark'
+            if lamps not in ('','0',None):
+                imagetyp = LAMPS_IMAGETYP.get(lamps)
+                if imagetyp:
+                    return imagetyp
+                if '1' in lamps and self._is_arc_setup(graname, grisname):
+                    return 'arclamp'
             else:
-                mercury = self.get_keyword('MERCURY')
-                neon = self.get_keyword('NEON')
-                argon = self.get_keyword('ARGON')
-                cadmium = self.get_keyword('CADMIUM')
-                zinc = self.get_keyword('ZINC')
                 halogen = self.get_keyword('HALOGEN')
-                krypton = self.get_keyword('KRYPTON')
-                xenon = self.get_keyword('XENON')
-                feargon = self.get_keyword('FEARGON')
-                deuterium = self.get_keyword('DEUTERI')
+                arclamps = tuple(self.get_keyword(key) for key in ARC_LAMP_KEYWORDS)
 
                 if halogen == 'on':
                     return 'flatlamp'
-                elif 'on' in [neon,argon,cadmium,zinc,krypton,xenon,feargon,deuterium]:
-                    if self._is_red(instrume):
-                        if graname != 'mirror':
-                            return 'arclamp'
-                    elif self._is_blue(instrume):
-                        if grisname != 'clear':
-                            return 'arclamp'
-                elif all(element == 'off' for element in [neon,argon,cadmium,zinc,halogen,krypton,xenon,feargon,deuterium]):
+                elif 'on' in arclamps:
+                    if self._is_arc_setup(graname, grisname):
+                        return 'arclamp'
+                elif halogen == 'off' and all(element == 'off' for element in arclamps):
                     return 'dark'
 
         #undefined
         return 'undefined'
 
 
+    def _is_arc_setup(self, graname, grisname):
+        '''
+        Lit arc lamps only make an arc if the grating (red) or grism (blue) is in the beam
+        '''
+        if self.is_red:
+            return graname != 'mirror'
+        if self.is_blue:
+            return grisname != 'clear'
+        return False
+
+
     def set_obsmode(self):
         '''
         Determine observation mode
@@ -274,15 +424,14 @@ class Lris(instrument.Instrument):
         grism = self.get_keyword('GRISNAME')
         grating = self.get_keyword('GRANAME')
         angle = self.get_keyword('GRANGLE')
-        instrume = self.get_keyword('INSTRUME')
 
-        if self._is_blue(instrume):
+        if self.is_blue:
 
-            if ('cl' in grism) or ('NB' in grism):
+            if grism.startswith(BLUE_IMAGING_GRISMS):
                 obsmode = 'IMAGING'
             else:
                 obsmode = 'SPEC'
-        elif self._is_red(instrume):
+        elif self.is_red:
             if grating == 'mirror':
                 obsmode = 'IMAGING'
             else:
@@ -298,7 +447,6 @@ class Lris(instrument.Instrument):
         '''
         is_null = False
 
-        instr = self.get_keyword('INSTRUME')
         slitname = self.get_keyword('SLITNAME')
         obsmode = self.get_keyword('OBSMODE')
         grating = self.get_keyword('GRANAME')
@@ -310,79 +458,30 @@ class Lris(instrument.Instrument):
         #Imaging mode
         if obsmode == 'IMAGING':
             flt = ''
-            if self._is_red(instr):
-                flt = self.get_keyword('REDFILT')
-                wavearr = dict({'clear':[3500,9000],
-                                'B':[3800,5300],
-                                'V':[4800,6600],
-                                'R':[5500,8200],
-                                'Rs':[6000,7500],
-                                'I':[6800,8400],
-                                'GG495':[4800,4950],
-                                'OG570':[5500,5700],
-                                'RG850':[8200,8500],
-                                'NB4000':[3800,4200],
-                                'NB5390':[5350,5400],
-                                'NB6741':[6700,6800],
-                                'NB8185':[8150,8250],
-                                'NB8560':[8500,8650],
-                                'NB9135':[9100,9200],
-                                'NB9148':[9050,9250],
-                                'NB4325':[9050,9520]})
-            elif self._is_blue(instr):
-                flt = self.get_keyword('BLUFILT')
-                wavearr = dict({'clear':[3000,6500],
-                                'U':[3050,4000],
-                                'B':[3900,4900],
-                                'V':[5800,6600],
-                                'G':[4100,5300],
-                                'SP580':[0,0],
-                                'NB4170':[0,0]})
+            if self.side:
+                fltkey, wavearr = FILTER_SETUP[self.side]
+                flt = self.get_keyword(fltkey)
             if flt == 'Clear':
                 flt = 'clear'
 
         #Spectroscopy mode
         else:
-            if self._is_red(instr):
+            if self.is_red:
                 wlen = self.get_keyword('WAVELEN')
                 if not wlen: return True
-                wavearr = dict({'150/7500':[wlen-12288/2,wlen+12288/2],
-                                '300/5000':[wlen-6525/2,wlen+6525/2],
-                                '400/8500':[wlen-4762/2,wlen+4762/2],
-                                '600/5000':[wlen-3275/2,wlen+3275/2],
-                                '600/7500':[wlen-3275/2,wlen+3275/2],
-                                '600/10000':[wlen-3275/2,wlen+3275/2],
-                                '831/8200':[wlen-2375/2,wlen+2375/2],
-                                '900/5500':[wlen-2175/2,wlen+2175/2],
-                                '1200/7500':[wlen-1638/2,wlen+1638/2],
-                                '1200/9000':[wlen-1638/2,wlen+1638/2]})
+                coverage = RED_GRATING_COVERAGE
                 dateobs = self.get_keyword('DATE-OBS')
-                date = dt.datetime.strptime(dateobs,'%Y-%M-%d')
-                newthreshold = dt.datetime(2015,5,14)
                 #if observing date before May 14th, 2015, use different set of gratings
-                if date < newthreshold:
-                    wavearr = dict({'150/7500':[wlen-9830/2,wlen+9830/2],
-                                    '158/8500':[wlen-9830/2,wlen+9830/2],
-                                    '300/5000':[wlen-5220/2,wlen+5220/2],
-                                    '400/8500':[wlen-3810/2,wlen+3810/2],
-                                    '600/5000':[wlen-2620/2,wlen+2620/2],
-                                    '600/7500':[wlen-2620/2,wlen+2620/2],
-                                    '600/10000':[wlen-2620/2,wlen+2620/2],
-                                    '831/8200':[wlen-1900/2,wlen+1900/2],
-                                    '900/5500':[wlen-1740/2,wlen+1740/2],
-                                    '1200/7500':[wlen-1310/2,wlen+1310/2]})
-            elif self._is_blue(instr):
+                if dateobs[:10] < NEW_GRATINGS_DATE:
+                    coverage = RED_GRATING_COVERAGE_OLD
+                #only the grating (or grism) in use is looked up below
+                wavearr = {key: (wlen-coverage[key]/2, wlen+coverage[key]/2) for key in (grating, grism) if key in coverage}
+            elif self.is_blue:
                 #longslit
                 if 'long_' in slitmask or 'pol_' in slitmask:
-                    wavearr = dict({'300/5000':[1570,7420],
-                                    '400/3400':[1270,5740],
-                                    '600/4000':[3010,5600],
-                                    '1200/3400':[2910,3890]})
+                    wavearr = BLUE_GRISM_WAVES_LONG
                 else:
-                    wavearr = dict({'300/5000':[2210,8060],
-                                    '400/3400':[1760,6220],
-                                    '600/4000':[3300,5880],
-                                    '1200/3400':[3010,4000]})
+                    wavearr = BLUE_GRISM_WAVES
             else:
                 return True
 
@@ -390,11 +489,7 @@ class Lris(instrument.Instrument):
         #NOTE: Elysia fixed bug in IDL code was incorrectly not truncating the wavelength range 
         #bc the dichroic wavelength is in nanometers and the wavelength range is in angstroms.
         dichname = self.get_keyword('DICHNAME')
-        if   dichname == '460': minmax = 4874
-        elif dichname == '500': minmax = 5091
-        elif dichname == '560': minmax = 5696
-        elif dichname == '680': minmax = 6800
-        else                  : minmax = 0
+        minmax = DICHROIC_CUTOFF.get(dichname, 0)
 
         #determine wavelength range
         if obsmode == 'IMAGING':
@@ -408,16 +503,12 @@ class Lris(instrument.Instrument):
         #if wavelength range encompasses dichroic cutoff
         #LRIS: minmax to wavered
         #LRISBLUE: waveblue to minmax
-        if self._is_red(instr):
-            if waveblue < minmax:
-                waveblue = minmax
-        elif self._is_blue(instr):
-            if wavered > minmax:
-                wavered = minmax
-
-        #round to the nearest 10 angstroms
-        wavered  = int(round(np.round(wavered,-1)))
-        waveblue = int(round(np.round(waveblue,-1)))
+        if   self.is_red : waveblue = max(waveblue, minmax)
+        elif self.is_blue: wavered  = min(wavered, minmax)
+
+        #round to the nearest 10 angstroms (round half to even, same as np.round)
+        wavered  = int(round(wavered, -1))
+        waveblue = int(round(waveblue, -1))
         wavecntr = int(round((waveblue + wavered)/2))
 
         self.set_keyword('WAVERED', wavered, 'KOA: Red wavelength')
@@ -430,34 +521,7 @@ class Lris(instrument.Instrument):
         '''
         Set CCD gain and read noise
         '''
-
-        return True
-
-        # NOTE: It looks like the IDL version for LRIS BLUE was incorrectly writing "00" index 
-        # versions of these keywords to the header that didn't match the metadata file which only
-        #has 1-4.  And it was writing null for the "04" version.  We are mimicing this behavior below.
-        ccdgain = 'null'
-        readnoise = 'null'
-
-        #gain and read noise values per extension
-        gainblue = [1.55,  1.56,  1.63,  1.70]
-        rnblue   = [3.9,   4.2,   3.6,   3.6]
-        gainred  = [1.255, 1.180, 1.191, 1.162]
-        rnred    = [4.64,  4.76,  4.54,  4.62]
-
-        #red or blue?
-        instr = self.get_keyword('INSTRUME')
-        if self._is_blue(instr):
-            gain = gainblue
-            rn = rnblue
-        elif self._is_red(instr):
-            gain = gainred
-            rn = rnred
-
-        for ext in range(1, self.nexten+1):
-            amploc = int(self.get_keyword('AMPLOC',ext=ext))
-            self.set_keyword(f'CCDGN0{amploc}', gain[amploc-1], 'KOA: CCD Gain')
-            self.set_keyword(f'CCDRN0{amploc}', rn[amploc-1], 'KOA: CCD Read Noise')
+        #NOTE: CCD gain and read noise are currently not written for LRIS
         return True
 
     def set_sig2nois(self):
@@ -466,7 +530,8 @@ class Lris(instrument.Instrument):
         '''
 
         #NOTE: Decided to remove this calc from KOA so setting to null.
-        self.set_keyword('SIG2NOIS', 'null', 'KOA: S/N estimate near image spectral center')
+        #Constant value, so write the card directly rather than through set_keyword checks.
+        self.fits_hdu[0].header['SIG2NOIS'] = ('null', 'KOA: S/N estimate near image spectral center')
         return True
 
         # if self.nexten == 0: return True
@@ -484,14 +549,13 @@ class Lris(instrument.Instrument):
         # nx = (naxis2 - numamps*(precol + postpix))
         # c = [naxis1/2, 1.17*nx/2]
         # wsize = 10
-        # spaflux = []
 
         # #necessary?
         # if c[1] > naxis1-wsize:
         #     c[1] = c[0]
 
-        # for i in range(wsize, int(naxis1)-wsize):
-        #     spaflux.append(np.median(image[int(c[1])-wsize:int(c[1])+wsize, i]))
+        # #median of each column of the window in one call
+        # spaflux = np.median(image[int(c[1])-wsize:int(c[1])+wsize, wsize:int(naxis1)-wsize], axis=0)
 
         # spaflux = convolve(spaflux,Box1DKernel(3))
         # maxflux = np.max(spaflux[precol:naxis1-1])
@@ -508,36 +572,26 @@ class Lris(instrument.Instrument):
         Determine number of amplifiers
         '''
         #separate logic for LRISBLUE
-        if self._is_blue(self.get_keyword('INSTRUME')):
+        if self.is_blue:
             amplist = self.get_keyword('AMPLIST', default='').strip()
-            if   amplist == '1,0,0,0':  numamps = 1
-            elif amplist == '2,0,0,0':  numamps = 1
-            elif amplist == '2,1,0,0':  numamps = 2
-            elif amplist == '1,3,0,0':  numamps = 1
-            elif amplist == '2,4,0,0':  numamps = 1
-            elif amplist == '1,4,0,0':  numamps = 2
-            else                     :  numamps = 0
-            return numamps
+            return AMPLIST_NUMAMPS.get(amplist, 0)
 
         #lris red
         ampmode = self.get_keyword('AMPMODE', default='')
-        if   'SINGLE:L' in ampmode: numamps = 1
-        elif 'SINGLE:R' in ampmode: numamps = 1
-        elif 'DUAL:L+R' in ampmode: numamps = 2
-        else                      : numamps = 0
-        return numamps
+        return next((numamps for mode, numamps in AMPMODE_NUMAMPS if mode in ampmode), 0)
 
     def get_nexten(self):
         '''
         Determine number of FITS HDU extensions
         '''
         self.nexten = len(self.fits_hdu)-1
+        self.ext_range = range(1, self.nexten+1)
         return True
 
     def set_wcs(self):
 
         # skip for RED after upgrade (20210422)
-        if self._is_red(self.get_keyword('INSTRUME')):
+        if self.is_red:
             return True
 
         #only do this for IMAGING
@@ -546,7 +600,7 @@ class Lris(instrument.Instrument):
             return True        
 
         pixelscale = 0.135 #arcsec
-        rotposn = self.get_keyword('ROTPOSN')
+        rotposn = self.get_keyword('ROTPOSN', default='null')
         poname  = self.get_keyword('PONAME')
         ra      = self.get_keyword('RA')
         dec     = self.get_keyword('DEC')
@@ -556,22 +610,9 @@ class Lris(instrument.Instrument):
 
         pixcorrect = lambda x: (x/pixelscale) + 1024
 
-        #dictionary of xim and yim only
-        podict = dict({'REF':[380.865,71.44],
-                       'REFO':[-377.22,72.52],
-                       'LRIS':[3.97,-309.82],
-                       'slitb':[-14.41,-263.74],
-                       'slitc':[31.85,-262.58],
-                       'POL':[3.91,-273.12],
-                       'LRISB':[-53.11,-310.54],
-                       'PICKOFF':[27.95,-260.63],
-                       'MIRA':[3.67,-300.34],
-                       'BEDGE':[20.25,-260.68],
-                       'TEDGE':[-0.65,-263.68],
-                       'UNDEFINED':[-53.11,-320.54]})
-        if poname not in podict.keys():
+        if poname not in POINTING_ORIGINS:
             poname = 'UNDEFINED'
-        xim,yim = podict.get(poname)
+        xim,yim = POINTING_ORIGINS.get(poname)
         if poname == 'REF':
             xcen = 485
             ycen = 520
@@ -582,35 +623,38 @@ class Lris(instrument.Instrument):
             xcen = pixcorrect(yim+308.1)
             ycen = pixcorrect(3.4-xim)
 
+        #pointing is the same for every extension, so only parse it once
+        #(only the degrees are needed, so skip the SkyCoord frame setup)
+        ra_deg  = Angle(ra, unit=u.hourangle).degree
+        dec_deg = Angle(dec, unit=u.deg).degree
+
         #for each FITS header extension, calculate CRPIX1/2 and CDELT1/2
-        for i in range(1,self.nexten+1):
-            crpix1 = self.get_keyword('CRPIX1',ext=i)
-            crpix2 = self.get_keyword('CRPIX2',ext=i)
-            crval1 = self.get_keyword('CRVAL1',ext=i)
-            crval2 = self.get_keyword('CRVAL2',ext=i)
-            cd11   = self.get_keyword('CD1_1',ext=i)
-            cd22   = self.get_keyword('CD2_2',ext=i)
-            naxis1 = self.get_keyword('NAXIS1',ext=i)
-            naxis2 = self.get_keyword('NAXIS2',ext=i)            
+        for i in self.ext_range:
+            hdr    = self.fits_hdu[i].header
+            crpix1 = hdr.get('CRPIX1')
+            crpix2 = hdr.get('CRPIX2')
+            crval1 = hdr.get('CRVAL1')
+            crval2 = hdr.get('CRVAL2')
+            cd11   = hdr.get('CD1_1')
+            cd22   = hdr.get('CD2_2')
 
             crpix1_new = crpix1 + ((xcen - crval1)/cd11)
             crpix2_new = crpix2 + ((ycen - crval2)/cd22)
             cdelt1_new = cd11 * pixelscale
             cdelt2_new = cd22 * pixelscale
-            self.set_keyword('CRPIX1',crpix1_new,'KOA: CRPIX1',ext=i)
-            self.set_keyword('CRPIX2',crpix2_new,'KOA: CRPIX2',ext=i)
-            self.set_keyword('CDELT1',cdelt1_new,'KOA: CDELT1',ext=i)
-            self.set_keyword('CDELT2',cdelt2_new,'KOA: CDELT2',ext=i)
-            self.set_keyword('CTYPE1','RA---TAN','KOA: CTYPE1',ext=i)
-            self.set_keyword('CTYPE2','DEC--TAN','KOA: CTYPE2',ext=i)
-            self.set_keyword('CROTA2',rotposn,'KOA: Rotator position',ext=i)
-
-            #set crval1/2 after we have used their original values
-            coord = SkyCoord(f'{ra} {dec}', unit=(u.hourangle, u.deg))
-            ra_deg  = coord.ra.degree
-            dec_deg = coord.dec.degree
-            self.set_keyword('CRVAL1',ra_deg,'KOA: CRVAL1',ext=i)
-            self.set_keyword('CRVAL2',dec_deg,'KOA: CRVAL2',ext=i)
+
+            #write all the cards in one update (crval1/2 are replaced after we have used their original values),
+            #with the same None/inf/nan to 'null' handling as set_keyword
+            cards = {'CRPIX1': (crpix1_new, 'KOA: CRPIX1'),
+                     'CRPIX2': (crpix2_new, 'KOA: CRPIX2'),
+                     'CDELT1': (cdelt1_new, 'KOA: CDELT1'),
+                     'CDELT2': (cdelt2_new, 'KOA: CDELT2'),
+                     'CTYPE1': ('RA---TAN', 'KOA: CTYPE1'),
+                     'CTYPE2': ('DEC--TAN', 'KOA: CTYPE2'),
+                     'CROTA2': (rotposn, 'KOA: Rotator position'),
+                     'CRVAL1': (ra_deg, 'KOA: CRVAL1'),
+                     'CRVAL2': (dec_deg, 'KOA: CRVAL2')}
+            hdr.update({key: (self._null_value(key, value), comment) for key, (value, comment) in cards.items()})
 
         return True
 
@@ -639,48 +683,27 @@ class Lris(instrument.Instrument):
         Set SLITLEN, SLITWIDT, SPECRES, SPATSCAL
         '''
         slitname = self.get_keyword('SLITNAME')
-        if slitname in ['GOH_LRIS','direct']:
+        if slitname in SLIT_DIMS_SKIP:
             return True
         spatscal = 0.135
         wavelen = self.get_keyword('WAVECNTR')
-        slitdict = dict({'long_0.7':[175,0.7],
-                         'long_1.0':[175,1.0],
-                         'long_1.5':[175,1.5],
-                         'long_8.7':[175,8.7],
-                         'pol_1.0':[25,1.0],
-                         'pol_1.5':[25,1.5]})
         try:
-            [slitlen,slitwidt] = slitdict.get(slitname)
+            [slitlen,slitwidt] = SLIT_DIMS.get(slitname)
         except:
             slitlen,slitwidt = 'null','null'
 
         dispersion = 0
         fwhm = 0
-        instr = self.get_keyword('INSTRUME')
-        if self._is_red(instr):
+        if self.is_red:
             grating = self.get_keyword('GRANAME')
-            gratdict = dict({'150/7500':[3.00,0],
-                             '300/5000':[0,9.18],
-                             '400/8500':[1.16,6.90],
-                             '600/5000':[0.80,4.70],
-                             '600/7500':[0.80,4.70],
-                             '600/10000':[0.80,4.70],
-                             '831/8200':[0.58,0],
-                             '900/5500':[0.53,0],
-                             '1200/7500':[0.40,0],
-                             '1200/9000':[0.40,0]})
             try:
-                [dispersion,fwhm] = gratdict.get(grating)
+                [dispersion,fwhm] = RED_GRATING_RES.get(grating)
             except:
                 dispersion,fwhm = 0,0
-        elif self._is_blue(instr):
+        elif self.is_blue:
             grism = self.get_keyword('GRISNAME')
-            grismdict = dict({'300/5000':[1.43,8.80],
-                              '400/3400':[1.09,6.80],
-                              '600/4000':[0.63,3.95],
-                              '1200/3400':[0.24,1.56]})
             try:
-                [dispersion,fwhm] = grismdict.get(grism)
+                [dispersion,fwhm] = BLUE_GRISM_RES.get(grism)
             except:
                 dispersion,fwhm = 0,0
         specres = 'null'
@@ -717,13 +740,23 @@ class Lris(instrument.Instrument):
             return False
 
         nPixSat = 0
-        for ext in range(1, self.nexten+1):
+        mask = None
+        for ext in self.ext_range:
             hdu = self.fits_hdu[ext]
             # Now skipping this for LRIS-RED (20210422)
-            if 'ImageHDU' not in str(type(hdu)): continue
+            if not isinstance(hdu, IMAGE_HDU_TYPES): continue
+            #skip data-less extensions without touching .data
+            if not hdu.header.get('NAXIS'): continue
             image = hdu.data
-            pixSat = image[np.where(image >= satVal)]
-            nPixSat += len(image[np.where(image >= satVal)])
+            #count in row blocks so the boolean mask stays small instead of image sized,
+            #comparing into one mask shared by all blocks and extensions of the same width
+            if mask is None or mask.shape[1:] != image.shape[1:]:
+                mask = np.empty((NPIXSAT_BLOCK_ROWS,) + image.shape[1:], dtype=bool)
+            for row in range(0, image.shape[0], NPIXSAT_BLOCK_ROWS):
+                block = image[row:row+NPIXSAT_BLOCK_ROWS]
+                out = mask[:block.shape[0]]
+                np.greater_equal(block, satVal, out=out)
+                nPixSat += int(np.count_nonzero(out))
 
         self.set_keyword('NPIXSAT', nPixSat, 'KOA: Number of saturated pixels')
 
@@ -750,102 +783,125 @@ class Lris(instrument.Instrument):
         #.................................  v
         #<------------NAXIS1------------->
 
+        #find widths of pre/postscan regions (same for all extensions)
+        precol = self.get_keyword('PRECOL')
+        postpix = self.get_keyword('POSTPIX')
+        binning = self.get_keyword('BINNING')
+        if precol  == None: return True
+        if postpix == None: return True
+        if binning == None: return True
+
+        xbin = 1
+        ybin = 1
+        if binning and ',' in binning:
+            xbin, ybin = map(int, binning.replace(' ', '').split(',')[:2])
+
+        #binned pre/postscan widths
+        precol_x  = precol//xbin
+        postpix_x = postpix//xbin
+
+        # Size of sampling box: nx = 15 & ny = 15
+        nx = postpix_x - postpix_x//3
+        if nx > 15 or nx == 0: nx = 15
+        ny = nx
+
         #cycle through FITS extensions
-        for ext in range(1,self.nexten+1):
+        for ext in self.ext_range:
 
             #get image header and image
-            hdu = self.fits_hdu[ext].header
-            if 'ImageHDU' not in str(type(hdu)): continue
-            header = hdu.header
-            image = hdu.data #np.array(self.fits_hdu[ext].data)
-
-            #find widths of pre/postscan regions, whole image dimensions
-            precol = self.get_keyword('PRECOL')
-            postpix = self.get_keyword('POSTPIX')
-            binning = self.get_keyword('BINNING')
-            naxis1 = self.get_keyword('NAXIS1',ext=ext)
-            naxis2 = self.get_keyword('NAXIS2',ext=ext)
-            if precol  == None: return True
-            if postpix == None: return True
-            if binning == None: return True
+            hdu = self.fits_hdu[ext]
+            if not isinstance(hdu, IMAGE_HDU_TYPES): continue
+            hdr = hdu.header
+
+            #whole image dimensions
+            naxis1 = hdr.get('NAXIS1')
+            naxis2 = hdr.get('NAXIS2')
             if naxis1  == None: return True
             if naxis2  == None: return True
 
-            # Size of sampling box: nx = 15 & ny = 15
-            xbin = 1
-            ybin = 1
-            if binning and ',' in binning:
-                binning = binning.replace(' ', '').split(',')
-                xbin = int(binning[0])
-                ybin = int(binning[1])
-            nx = postpix//xbin
-            nx = nx - nx//3
-            if nx > 15 or nx == 0: nx = 15
-            ny = nx
+            #ccd and amplifier location name the keywords, so skip an extension without them
+            ccdloc = hdr.get('CCDLOC')
+            amploc = hdr.get('AMPLOC')
+            if ccdloc == None or amploc == None:
+                log.info(f'set_image_stats: no CCDLOC/AMPLOC in extension {ext}, skipping')
+                continue
+
+            #adjust ccdloc for type
+            ccdloc = int(ccdloc)
+            if self.is_blue:
+                ccdloc += 1
+
+            #NOTE: In order to mimic incorrect IDL behavior, we are not subtracting 1 from AMPLOC.
+            #This means red images will have null values for IM01MN02 and IM02MN04 in metadata but header will have these values.
+            amploc = int(amploc)
+            #if self.get_keyword('INSTRUME') == 'LRIS': amploc -= 1
+
+            #only touch the data (and read it in) once the header checks pass
+            image = hdu.data
 
             # x: number of imaging pixels and start of postscan 
-            nxi = naxis1 - postpix//xbin - precol//xbin
-            px1 = precol//xbin + nxi - 1
+            nxi = naxis1 - postpix_x - precol_x
+            px1 = precol_x + nxi - 1
 
             # center of imaging pixels and postscan 
-            cxi = precol//xbin + nxi//2
+            cxi = precol_x + nxi//2
             cyi = naxis2//2 
-            cxp = px1 + postpix//xbin//2
+            cxp = px1 + postpix_x//2
        
-            #transpose image to correspond with precol/postpix parameters
-            image = np.transpose(image)
-
+            #NOTE: x runs along NAXIS1 (precol/postpix) and numpy indexes [y, x], so slice
+            #the windows as [y, x] rather than transposing the whole image.
             #take statistics of middle  pixels of image
             x1 = int(cxi-nx//2)
             x2 = int(cxi+nx//2)
             y1 = int(cyi-ny//2)
             y2 = int(cyi+ny//2)
-            imsample = image[x1:x2+1, y1:y2+1]
-            im1mn    = np.mean(imsample)
-            im1stdv  = np.std(imsample)
-            im1md    = np.median(imsample)
+            im1mn, im1stdv, im1md = Lris._window_stats(image[y1:y2+1, x1:x2+1])
 
             #take statistics of middle pixels of postscan
             x1 = int(cxp-nx//2)
             x2 = int(cxp+nx//2)
             y1 = int(cyi-ny//2)
             y2 = int(cyi+ny//2)
-            pssample = image[x1:x2+1, y1:y2+1]
-            pst1mn   = np.mean(pssample)
-            pst1stdv = np.std(pssample)
-            pst1md   = np.median(pssample)
-
-            #get ccdloc and adjust for type
-            ccdloc = int(self.get_keyword('CCDLOC',ext=ext))
-            if self._is_blue(self.get_keyword('INSTRUME')):
-                ccdloc += 1
-
-            #get amplifier location and adjust for type
-            #NOTE: In order to mimic incorrect IDL behavior, we are not subtracting 1 from AMPLOC.
-            #This means red images will have null values for IM01MN02 and IM02MN04 in metadata but header will have these values.
-            amploc = int(self.get_keyword('AMPLOC',ext=ext))
-            #if self.get_keyword('INSTRUME') == 'LRIS': amploc -= 1
+            pst1mn, pst1stdv, pst1md = Lris._window_stats(image[y1:y2+1, x1:x2+1])
 
             #create and set image keywords
             #todo: confirm our fix when there are only 2 extentions is correct (idl code looks to have shifted red values up one)
-            mnkey   = f'IM0{ccdloc}MN0{amploc}'
-            stdvkey = f'IM0{ccdloc}SD0{amploc}'
-            mdkey   = f'IM0{ccdloc}MD0{amploc}'
-            self.set_keyword(mnkey,   str(round(im1mn, 2)),   f'KOA: Imaging mean CCD {ccdloc}, amp location {amploc}')
-            self.set_keyword(stdvkey, str(round(im1stdv, 2)), f'KOA: Imaging standard deviation CCD {ccdloc}, amp location {amploc}')
-            self.set_keyword(mdkey,   str(round(im1md, 2)),   f'KOA: Imaging median CCD {ccdloc}, amp location {amploc}')
+            #NOTE: values stay str(round(x, 2)) ('1234.5', not '1234.50') to keep the stored strings unchanged
+            loc = f'CCD {ccdloc}, amp location {amploc}'
+            self.set_keyword(f'IM0{ccdloc}MN0{amploc}', str(round(im1mn, 2)),   f'KOA: Imaging mean {loc}')
+            self.set_keyword(f'IM0{ccdloc}SD0{amploc}', str(round(im1stdv, 2)), f'KOA: Imaging standard deviation {loc}')
+            self.set_keyword(f'IM0{ccdloc}MD0{amploc}', str(round(im1md, 2)),   f'KOA: Imaging median {loc}')
 
             #create and set postscan keywords
-            mnkey   = f'PT0{ccdloc}MN0{amploc}'
-            stdvkey = f'PT0{ccdloc}SD0{amploc}'
-            mdkey   = f'PT0{ccdloc}MD0{amploc}'
-            self.set_keyword(mnkey,   str(round(pst1mn, 2)),   f'KOA: Postscan mean CCD {ccdloc}, amp location {amploc}')
-            self.set_keyword(stdvkey, str(round(pst1stdv, 2)), f'KOA: Postscan standard deviation CCD {ccdloc}, amp location {amploc}')
-            self.set_keyword(mdkey,   str(round(pst1md, 2)),   f'KOA: Postscan median CCD {ccdloc}, amp location {amploc}')
+            self.set_keyword(f'PT0{ccdloc}MN0{amploc}', str(round(pst1mn, 2)),   f'KOA: Postscan mean {loc}')
+            self.set_keyword(f'PT0{ccdloc}SD0{amploc}', str(round(pst1stdv, 2)), f'KOA: Postscan standard deviation {loc}')
+            self.set_keyword(f'PT0{ccdloc}MD0{amploc}', str(round(pst1md, 2)),   f'KOA: Postscan median {loc}')
 
         return True
 
 
+    @staticmethod
+    def _window_stats(window):
+        '''
+        Mean, standard deviation and median of a small image window.
+        The window is copied once into a contiguous float64 buffer and all three stats are taken from it.
+        '''
+        flat = np.ascontiguousarray(window, dtype=np.float64).ravel()
+        n    = flat.size
+
+        #mean and std from the sum and sum of squares (one pass each over 225 pixels)
+        mean = flat.sum() / n
+        std  = math.sqrt(max(np.dot(flat, flat)/n - mean*mean, 0.0))
+
+        #median by partial sort: averages the middle element(s) the same way np.median does
+        lo = (n-1)//2
+        hi = n//2
+        part = np.partition(flat, (lo, hi))
+        median = part[lo:hi+1].mean()
+
+        return mean, std, median
+
+
     def create_jpg_from_fits(self, fits_filepath, outdir):
         '''
         Overriding instrument default function
@@ -853,96 +909,51 @@ class Lris(instrument.Instrument):
         Use DETSEC keyword to figure out data order/position
         '''
 
-        #open
-        hdus = fits.open(fits_filepath, ignore_missing_end=True)
-
-        #needed hdr vals
-        hdr0 = hdus[0].header
-
-        # is this a red file (after 2021-04-16)?
-        if self._is_red(hdr0['INSTRUME']):
-            data = hdus[0].data
-
-            # use histogram equalization to increase contrast
-            image_eq = exposure.equalize_hist(data)
-
-            # form filepaths
-            basename = os.path.basename(fits_filepath).replace('.fits', '')
-            jpg_filepath = f'{outdir}/{basename}.jpg'
-            # create jpg
-            dpi = 100
-            width_inches  = hdr0['NAXIS1'] / dpi
-            height_inches = hdr0['NAXIS2'] / dpi
-            fig = plt.figure(figsize=(width_inches, height_inches),
-                             frameon=False, dpi=dpi)
-            ax = fig.add_axes([0, 0, 1, 1])  # this forces no border padding
-            plt.axis('off')
-            plt.imshow(image_eq, cmap='gray', origin='lower')  # , norm=norm)
-            plt.savefig(jpg_filepath, quality=92)
-            plt.close()
-            return
-
-        # continue for blue side
-
-        binning  = hdr0['BINNING'].split(',')
-        precol   = int(hdr0['PRECOL'])   // int(binning[0])
-        postpix  = int(hdr0['POSTPIX'])  // int(binning[0])
-        preline  = int(hdr0['PRELINE'])  // int(binning[1])
-        postline = int(hdr0['POSTLINE']) // int(binning[1])
-
-        #get extension order (uses DETSEC keyword)
-        ext_order = Lris.get_ext_data_order(hdus)
-        assert ext_order, "ERROR: Could not determine extended data order"
-
-        #loop thru extended headers in order, create png and add to list in order
-        interval = ZScaleInterval()
-        vmin = None
-        vmax = None
-        alldata = None
-        for i, ext in enumerate(ext_order):
-
-            data = hdus[ext].data
-            hdr  = hdus[ext].header
-
-            #calc bias array from postpix area
-            sh = data.shape
-            x1 = 0
-            x2 = sh[0]
-            y1 = sh[1] - postpix + 1
-            y2 = sh[1] - 1
-            bias = np.median(data[x1:x2, y1:y2], axis=1)
-            bias = np.array(bias, dtype=np.int64)
-
-            #subtract bias
-            data = data - bias[:,None]
-
-            #get min max of each ext (not including pre/post pixels)
-            #NOTE: using sample box that is 90% of full area
-            #todo: should we take an average min/max of each ext for balancing?
-            sh = data.shape
-            x1 = int(preline          + (sh[0] * 0.10))
-            x2 = int(sh[0] - postline - (sh[0] * 0.10))
-            y1 = int(precol           + (sh[1] * 0.10))
-            y2 = int(sh[1] - postpix  - (sh[1] * 0.10))
-            tmp_vmin, tmp_vmax = interval.get_limits(data[x1:x2, y1:y2])
-            if vmin == None or tmp_vmin < vmin: vmin = tmp_vmin
-            if vmax == None or tmp_vmax > vmax: vmax = tmp_vmax
-            if vmin < 0: vmin = 0
-
-            #remove pre/post pix columns
-            data = data[:,precol:data.shape[1]-postpix]
-
-            #flip data left/right 
-            #NOTE: This should come after removing pre/post pixels
-            ds = Lris.get_detsec_data(hdr['DETSEC'])
-            if ds and ds[0] > ds[1]: 
-                data = np.fliplr(data)
-            if ds and ds[2] > ds[3]: 
-                data = np.flipud(data)
+        #open (closed again once the extensions are cropped and tiled)
+        with Lris._open_fits(fits_filepath) as hdus:
 
-            #concatenate horizontally
-            if i==0: alldata = data
-            else   : alldata = np.append(alldata, data, axis=1)
+            #needed hdr vals
+            hdr0 = Lris._read_header(hdus, 0)
+
+            # is this a red file (after 2021-04-16)?
+            if self._is_red(hdr0['INSTRUME']):
+                data = Lris._read_data(hdus, 0)
+
+                # use histogram equalization to increase contrast
+                # (skimage is only needed here, so import it on first use)
+                from skimage import exposure
+                image_eq = exposure.equalize_hist(data)
+
+                # form filepaths
+                basename = os.path.basename(fits_filepath).replace('.fits', '')
+                jpg_filepath = f'{outdir}/{basename}.jpg'
+                # create jpg
+                Lris._save_gray_jpg(image_eq, jpg_filepath)
+                return
+
+            # continue for blue side
+
+            precol, postpix, preline, postline = Lris._get_binned_scan_widths(hdr0)
+
+            #get extension order (uses DETSEC keyword)
+            ext_order, detsecs = Lris.get_ext_data_order(hdus)
+            assert ext_order, "ERROR: Could not determine extended data order"
+
+            #read the extension data here (reads through the shared file handle are not thread safe),
+            #then bias subtract, crop and flip the extensions in parallel (numpy releases the GIL)
+            datas = [Lris._read_data(hdus, ext) for ext in ext_order]
+            process = lambda data, ext: Lris._process_ext(data, detsecs[ext], precol, postpix, preline, postline)
+            with ThreadPoolExecutor(max_workers=len(ext_order)) as executor:
+                results = list(executor.map(process, datas, ext_order))
+            tiles   = [tile for tile, sample in results]
+            samples = [sample for tile, sample in results]
+
+            #concatenate horizontally (float32 is plenty for an 8 bit jpg and halves the stretch work)
+            alldata = Lris._tile_horizontally(tiles, dtype=np.float32)
+
+        #one ZScale over the samples of all the extensions, never below zero
+        vmin, vmax = ZScaleInterval().get_limits(np.concatenate(samples))
+        vmin = max(0.0, vmin)
 
         #filepath vars
         basename = os.path.basename(fits_filepath).replace('.fits', '')
@@ -954,17 +965,19 @@ class Lris(instrument.Instrument):
         # vmin += int((vmax - vmin) * minmax_adjust)
         # vmax -= int((vmax - vmin) * minmax_adjust)
 
-        #normalize, stretch and create jpg
-        norm = ImageNormalize(vmin=vmin, vmax=vmax, stretch=AsinhStretch())
-        dpi = 100
-        width_inches  = alldata.shape[1] / dpi
-        height_inches = alldata.shape[0] / dpi
-        fig = plt.figure(figsize=(width_inches, height_inches), frameon=False, dpi=dpi)
-        ax = fig.add_axes([0, 0, 1, 1]) #this forces no border padding; bbox_inches='tight' doesn't really work
-        plt.axis('off')
-        plt.imshow(alldata, cmap='gray', origin='lower', norm=norm)
-        plt.savefig(out_filepath, quality=92)
-        plt.close()
+        #normalize, clip and stretch in place (same steps as ImageNormalize with clip=True)
+        scale = 1.0 / (vmax - vmin) if vmax > vmin else 1.0
+        alldata -= vmin
+        alldata *= scale
+        np.clip(alldata, 0.0, 1.0, out=alldata)
+        AsinhStretch()(alldata, clip=False, out=alldata)
+
+        #scale to 8 bits the same way matplotlib's gray colormap does
+        alldata *= 256
+        image = np.minimum(alldata, 255).astype(np.uint8)
+
+        #create jpg (flip the rows so row 0 is at the bottom, like origin='lower')
+        Image.fromarray(image[::-1]).save(out_filepath, quality=92)
 
 
     def create_jpg_from_fits_HIST(self, fits_filepath, outdir):
@@ -975,46 +988,40 @@ class Lris(instrument.Instrument):
         '''
         #NOTE: Not using this right now until we decide if it is better than default create_jpg_from_fits
         
-        #open
-        hdus = fits.open(fits_filepath, ignore_missing_end=True)
-
-        #needed hdr vals
-        hdr0 = hdus[0].header
-        binning  = hdr0['BINNING'].split(',')
-        precol   = int(hdr0['PRECOL'])   // int(binning[0])
-        postpix  = int(hdr0['POSTPIX'])  // int(binning[0])
-        preline  = int(hdr0['PRELINE'])  // int(binning[1])
-        postline = int(hdr0['POSTLINE']) // int(binning[1])
-
-        #get extension order (uses DETSEC keyword)
-        ext_order = Lris.get_ext_data_order(hdus)
-        assert ext_order, "ERROR: Could not determine extended data order"
-
-        #loop thru extended headers in order, create png and add to list in order
-        vmin = None
-        vmax = None
-        alldata = None
-        for i, ext in enumerate(ext_order):
-
-            data = hdus[ext].data
-            hdr  = hdus[ext].header
-
-            #remove pre/post pix columns
-            data = data[:,precol:data.shape[1]-postpix]
-
-            #flip data left/right 
-            #NOTE: This should come after removing pre/post pixels
-            ds = Lris.get_detsec_data(hdr['DETSEC'])
-            if ds and ds[0] > ds[1]: 
-                data = np.fliplr(data)
-            if ds and ds[2] > ds[3]: 
-                data = np.flipud(data)
+        #open (closed again once the extensions are tiled)
+        with Lris._open_fits(fits_filepath) as hdus:
+
+            #needed hdr vals
+            hdr0 = Lris._read_header(hdus, 0)
+            precol, postpix, preline, postline = Lris._get_binned_scan_widths(hdr0)
+
+            #get extension order (uses DETSEC keyword)
+            ext_order, detsecs = Lris.get_ext_data_order(hdus)
+            assert ext_order, "ERROR: Could not determine extended data order"
+
+            #loop thru extended headers in order, create png and add to list in order
+            vmin = None
+            vmax = None
+            tiles = []
+            for i, ext in enumerate(ext_order):
+
+                data = Lris._read_data(hdus, ext)
+
+                #remove pre/post pix columns
+                data = data[:,precol:data.shape[1]-postpix]
+
+                #flip data left/right 
+                #NOTE: This should come after removing pre/post pixels
+                data = Lris._flip_to_detsec(data, detsecs[ext])
+
+                #collect for horizontal tiling
+                tiles.append(data)
 
             #concatenate horizontally
-            if i==0: alldata = data
-            else   : alldata = np.append(alldata, data, axis=1)
+            alldata = Lris._tile_horizontally(tiles)
 
         #hist
+        import hist_equal2d
         heq2d = hist_equal2d.HistEqual2d()
         alldata = heq2d._perform(alldata)
 
@@ -1022,33 +1029,178 @@ class Lris(instrument.Instrument):
         basename = os.path.basename(fits_filepath).replace('.fits', '')
         out_filepath = f'{outdir}/{basename}.jpg'
 
-        #normalize, stretch and create jpg
-        dpi = 100
-        width_inches  = alldata.shape[1] / dpi
-        height_inches = alldata.shape[0] / dpi
-        fig = plt.figure(figsize=(width_inches, height_inches), frameon=False, dpi=dpi)
-        ax = fig.add_axes([0, 0, 1, 1]) #this forces no border padding; bbox_inches='tight' doesn't really work
-        plt.axis('off')
-        plt.imshow(alldata, cmap='gray', origin='lower')
-        plt.savefig(out_filepath, quality=92)
-        plt.close()
+        #normalize and create jpg
+        Lris._save_gray_jpg(alldata, out_filepath)
+
+
+    @staticmethod
+    def _save_gray_jpg(data, filepath):
+        '''
+        Write an image as a grayscale jpg with PIL, scaled the way imshow(cmap='gray', origin='lower')
+        did it: data min/max to 8 bits, flipped so row 0 is at the bottom
+        '''
+        vmin  = float(data.min())
+        vmax  = float(data.max())
+        scale = 256.0 / (vmax - vmin) if vmax > vmin else 0.0
+        image = np.minimum((data - vmin) * scale, 255).astype(np.uint8)
+        Image.fromarray(image[::-1]).save(filepath, quality=92)
+
+
+    @staticmethod
+    def _open_fits(fits_filepath):
+        '''
+        Open a FITS file for the jpgs with fitsio if it is installed, otherwise with astropy
+        NOTE: memmap is left at the astropy default, since memmap=True refuses to load the
+        BZERO scaled (uint16) raw CCD data
+        '''
+        if fitsio is not None:
+            return fitsio.FITS(fits_filepath)
+        return fits.open(fits_filepath, ignore_missing_end=True)
+
+
+    @staticmethod
+    def _read_header(hdus, ext):
+        '''
+        Header of an extension of a fitsio or astropy file
+        '''
+        if fitsio is not None and isinstance(hdus, fitsio.FITS):
+            return hdus[ext].read_header()
+        return hdus[ext].header
+
+
+    @staticmethod
+    def _read_data(hdus, ext):
+        '''
+        Pixel data of an extension of a fitsio or astropy file
+        '''
+        if fitsio is not None and isinstance(hdus, fitsio.FITS):
+            return hdus[ext].read()
+        return hdus[ext].data
+
+
+    @staticmethod
+    def _get_binned_scan_widths(hdr0):
+        '''
+        Read the pre/postscan column and line widths from the primary header, in binned pixels
+        '''
+        xbin, ybin = map(int, hdr0['BINNING'].split(',')[:2])
+        precol   = int(hdr0['PRECOL'])   // xbin
+        postpix  = int(hdr0['POSTPIX'])  // xbin
+        preline  = int(hdr0['PRELINE'])  // ybin
+        postline = int(hdr0['POSTLINE']) // ybin
+        return precol, postpix, preline, postline
+
+
+    @staticmethod
+    def _process_ext(data, ds, precol, postpix, preline, postline):
+        '''
+        Bias subtract, crop and flip one blue extension for the jpg mosaic.
+        Returns the extension tile and a flat pixel sample for the ZScale limits.
+        '''
+        #calc bias array from postpix area
+        sh = data.shape
+        x1 = 0
+        x2 = sh[0]
+        y1 = sh[1] - postpix + 1
+        y2 = sh[1] - 1
+        bias = Lris._row_median(data[x1:x2, y1:y2])
+
+        #remove pre/post pix columns and subtract bias in the same pass, so only the
+        #kept pixels are written (16 bit CCD data minus an int32 column promotes to int32)
+        #NOTE: no bias subtraction if there is no postscan strip to take it from
+        ncols = sh[1]
+        if bias is None:
+            data = data[:,precol:ncols-postpix]
+        else:
+            data = data[:,precol:ncols-postpix] - bias.astype(np.int32)
+
+        #sample each ext for the min max (not including pre/post pixels)
+        #NOTE: using sample box that is 90% of full area (columns shifted by precol since
+        #the pre/post pix columns are already removed)
+        x1 = int(preline          + (sh[0] * 0.10))
+        x2 = int(sh[0] - postline - (sh[0] * 0.10))
+        y1 = int(precol           + (ncols * 0.10)) - precol
+        y2 = int(ncols - postpix  - (ncols * 0.10)) - precol
+        #NOTE: ZScale only samples ~1000 pixels, but first copies every finite pixel it is
+        #given, so only keep a strided subsample of the box
+        sample = data[x1:x2:ZSCALE_STRIDE, y1:y2:ZSCALE_STRIDE].ravel()
+
+        #flip data left/right 
+        #NOTE: This should come after removing pre/post pixels
+        data = Lris._flip_to_detsec(data, ds)
+
+        return data, sample
+
+
+    @staticmethod
+    def _row_median(strip):
+        '''
+        Median of each row of a strip, returned as a column.
+        Uses bottleneck if available, otherwise a partial sort (np.partition) of the middle
+        element(s) rather than np.median's full sort.  Even widths average the two middle values.
+        Returns None for a zero width strip (np.partition would raise, bottleneck gives all NaN).
+        '''
+        if strip.shape[1] == 0:
+            return None
+
+        if bn is not None:
+            #bottleneck falls back to numpy for 16 bit and non-native byte order (FITS) data,
+            #so hand it native float32 (exact for 16 bit values and their half sums)
+            return bn.median(strip.astype(np.float32), axis=1)[:,None]
+
+        n  = strip.shape[1]
+        lo = (n-1)//2
+        hi = n//2
+        part = np.partition(strip, (lo, hi), axis=1)
+        return part[:, lo:hi+1].mean(axis=1, keepdims=True)
+
+
+    @staticmethod
+    def _tile_horizontally(tiles, dtype=None):
+        '''
+        Copy the extension tiles left to right into one preallocated mosaic
+        (np.append in the loop re-copied the growing mosaic for every extension)
+        The mosaic dtype defaults to the common dtype of the tiles.
+        '''
+        if dtype is None:
+            dtype = np.result_type(*tiles)
+        shape = (tiles[0].shape[0], sum(tile.shape[1] for tile in tiles))
+        alldata = np.empty(shape, dtype=dtype)
+        x = 0
+        for tile in tiles:
+            np.copyto(alldata[:, x:x+tile.shape[1]], tile)
+            x += tile.shape[1]
+        return alldata
+
+
+    @staticmethod
+    def _flip_to_detsec(data, ds):
+        '''
+        Flip the data left/right and/or up/down to match the DETSEC direction.
+        The flips are negative stride views, so the only copy is the one into the mosaic.
+        '''
+        if ds and ds[0] > ds[1]:
+            data = data[:, ::-1]
+        if ds and ds[2] > ds[3]:
+            data = data[::-1, :]
+        return data
 
 
     @staticmethod
     def get_ext_data_order(hdus):
         '''
         Use DETSEC keyword to figure out true order of extension data for horizontal tiling
+        Returns the ordered extension list and the parsed DETSEC of each extension
         '''
-        key_orders = {}
+        detsecs = {}
         for i in range(1, len(hdus)):
-            ds = Lris.get_detsec_data(hdus[i].header['DETSEC'])
-            if not ds: return None
-            key_orders[ds[0]] = i
+            ds = Lris.get_detsec_data(Lris._read_header(hdus, i)['DETSEC'])
+            if not ds: return None, detsecs
+            detsecs[i] = ds
 
-        orders = []
-        for key in sorted(key_orders):
-            orders.append(key_orders[key])
-        return orders
+        #order by DETSEC x1 (ties keep HDU order)
+        orders = sorted(detsecs, key=lambda i: detsecs[i][0])
+        return orders, detsecs
 
 
     @staticmethod
@@ -1056,15 +1208,11 @@ class Lris(instrument.Instrument):
         '''
         Parse DETSEC string for x1, x2, y1, y2
         '''
-        match = re.search( r'(-?\d+):(-?\d+),(-?\d+):(-?\d+)', detsec)
+        match = DETSEC_RE.search(detsec)
         if not match:
             return None
         else:
-            x1 = int(match.groups(1)[0])
-            x2 = int(match.groups(1)[1])
-            y1 = int(match.groups(1)[2])
-            y2 = int(match.groups(1)[3])
-            return [x1, x2, y1, y2]
+            return [int(val) for val in match.groups()]
 
 
     def has_target_info(self):
@@ -1138,17 +1286,34 @@ class Lris(instrument.Instrument):
 
         return True
 
-    def _is_blue(self, inst_name):
-        if inst_name in ('LRISBLUE', 'LRISpBLUE'):
-            return True
+    def _get_side(self, inst_name):
+        '''
+        Returns 'red' or 'blue' for an LRIS INSTRUME value, None otherwise
+        '''
+        return INSTRUME_SIDE.get(inst_name)
 
-        return False
+    def _is_blue(self, inst_name):
+        return self._get_side(inst_name) == 'blue'
 
     def _is_red(self, inst_name):
-        if inst_name in ('LRIS', 'LRISp', 'LRISpRED'):
-            return True
+        return self._get_side(inst_name) == 'red'
 
-        return False
+    @property
+    def side(self):
+        '''
+        'red' or 'blue' for this file ('' if not LRIS), from INSTRUME looked up once
+        '''
+        if self._side is None:
+            self._side = self._get_side(self.get_keyword('INSTRUME')) or ''
+        return self._side
+
+    @property
+    def is_blue(self):
+        return self.side == 'blue'
+
+    @property
+    def is_red(self):
+        return self.side == 'red'
 
     def get_drp_destfile(self, koaid, srcfile):
         '''
@@ -108,9 +108,6 @@ class Instrument(dep.DEP):
         NOTE: Mapped values are only used if "useMap" is set to True,
               otherwise keyword name is as provided.
         """
-        if value is None:
-            value = 'null'
-
         # check for loaded fits_hdr
         if not self.fits_hdu[ext].header:
              raise Exception('get_keyword: ERROR: no FITS header loaded')
@@ -125,11 +122,8 @@ class Instrument(dep.DEP):
         if isinstance(keyword, list):
             keyword = keyword[0]
 
-        # handle infinite value
-        if value == math.inf or str(value).lower() in ('nan', '-nan'):
-            log.error(f'set_keyword: ERROR: keyword {keyword} value '
-                      f'is {value}.  Setting to null.')
-            value = 'null'
+        # handle missing, infinite and nan values
+        value = self._null_value(keyword, value)
 
         # if value == math.inf:
         #     log.warning(f'set_keyword: keyword {keyword} value is infinite.  Setting to null.')
@@ -138,6 +132,23 @@ class Instrument(dep.DEP):
         #ok now we can update
         (self.fits_hdu[ext].header).update({keyword : (value, comment)})
 
+    @staticmethod
+    def _null_value(keyword, value):
+        """
+        Returns 'null' in place of a None, infinite or nan keyword value,
+        otherwise the value unchanged.
+        """
+        if value is None:
+            return 'null'
+
+        # handle infinite value
+        if value == math.inf or str(value).lower() in ('nan', '-nan'):
+            log.error(f'set_keyword: ERROR: keyword {keyword} value '
+                      f'is {value}.  Setting to null.')
+            return 'null'
+
+        return value
+
 
     def set_koaid(self):
         """
@@ -441,22 +452,19 @@ class Instrument(dep.DEP):
                 self.log_error('SET_SEMESTER_FAIL')
                 return False
 
-            #Slightly unintuitive, but get utc datetime obj and subtract 10 hours to convert to HST
+            #Slightly unintuitive, but subtract 10 hours from UTC to convert to HST
             #and another 10 for 10 am cutoff as considered next days observing.
-            d = dt.datetime.strptime(dateObs+' '+utc, "%Y-%m-%d %H:%M:%S.%f")
-            d = d - dt.timedelta(hours=20)
-
-            #define cutoffs and see where it lands
-            #NOTE: d.year is wrong when date is Jan 1 and < 20:00:00, 
-            #but it doesn't matter since we assume 'B' which is correct for Jan1 
-            semA = dt.datetime.strptime(f'{d.year}-02-01 00:00:00.00', "%Y-%m-%d %H:%M:%S.%f")
-            semB = dt.datetime.strptime(f'{d.year}-08-01 00:00:00.00', "%Y-%m-%d %H:%M:%S.%f")
-            sem = 'B'
-            if d >= semA and d < semB: sem = 'A'
-
-            #adjust year if january
-            year = d.year
-            if d.month == 1: year -= 1
+            #NOTE: Only the month/day ordering matters, so rather than building datetime
+            #objects, fold month/day into one MMDD integer.  A UTC before 20:00 moves us
+            #to "day 0" of the month (ie. the last day of the previous month), which
+            #sorts before the 1st.
+            year = int(dateObs[0:4])
+            mmdd = int(dateObs[5:7]) * 100 + int(dateObs[8:10])
+            mmdd -= int(utc[0:2]) < 20
+
+            #A = [Feb 1, Aug 1), and anything before Feb 1 belongs to last year's B
+            sem = 'A' if 201 <= mmdd < 801 else 'B'
+            year -= mmdd < 201
 
             semester = f'{year}{sem}'
             self.set_keyword('SEMESTER', semester, 'Calculated SEMESTER from DATE-OBS')
@@ -720,9 +728,10 @@ class Instrument(dep.DEP):
             self.log_warn("SET_NPIXSAT_ERROR", "No saturate value.")
             return False
 
-        image = self.fits_hdu[ext].data     
-        pixSat = image[np.where(image >= satVal)]
-        nPixSat = len(image[np.where(image >= satVal)])
+        #NOTE: build the boolean mask once; reuse it (image[satMask]) if saturated values are needed
+        image = self.fits_hdu[ext].data
+        satMask = image >= satVal
+        nPixSat = int(satMask.sum(dtype=np.int64))
         self.set_keyword('NPIXSAT', nPixSat, 'KOA: Number of saturated pixels',ext=ext)
         return True
 
@@ -0,0 +1,108 @@
+import os
+import sys
+import numpy as np
+from astropy.io import fits
+import pytest
+
+#import from parent dir
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+import instr_kpf
+import instr_lris
+
+"""
+run jpg tests with
+pytest -m jpg
+"""
+
+def make_uint16_image(shape, seed):
+    '''Raw CCD like uint16 image (written as int16 with BZERO=32768)'''
+    rng = np.random.default_rng(seed)
+    return rng.integers(1000, 60000, size=shape).astype(np.uint16)
+
+
+@pytest.mark.jpg
+def test_kpf_jpg_bzero_without_fitsio(tmp_path, monkeypatch):
+    '''
+    The astropy fallback must load BZERO scaled amps (memmap=True refuses them)
+    '''
+    monkeypatch.setattr(instr_kpf, 'fitsio', None)
+
+    hdus = [fits.PrimaryHDU()]
+    for amp in (1, 2):
+        hdus.append(fits.ImageHDU(make_uint16_image((64, 32), amp), name=f'GREEN_AMP{amp}'))
+    fits_filepath = str(tmp_path / 'KP.20230101.00000.00.fits')
+    fits.HDUList(hdus).writeto(fits_filepath)
+    assert fits.getheader(fits_filepath, 1)['BZERO'] == 32768
+
+    instr_obj = instr_kpf.Kpf('KPF', None, None, None, None)
+    instr_obj.create_jpg_from_fits(fits_filepath, str(tmp_path))
+
+    assert os.path.isfile(tmp_path / 'KP.20230101.00000.00_green.jpg')
+
+
+@pytest.mark.jpg
+def test_lris_blue_jpg_bzero_without_fitsio(tmp_path, monkeypatch):
+    '''
+    The astropy path must load the BZERO scaled blue amps (memmap=True refuses them)
+    '''
+    monkeypatch.setattr(instr_lris, 'fitsio', None)
+
+    primary = fits.PrimaryHDU()
+    primary.header['INSTRUME'] = 'LRISBLUE'
+    primary.header['BINNING']  = '1,1'
+    primary.header['PRECOL']   = 5
+    primary.header['POSTPIX']  = 10
+    primary.header['PRELINE']  = 0
+    primary.header['POSTLINE'] = 0
+    hdus = [primary]
+    for amp in range(4):
+        hdu = fits.ImageHDU(make_uint16_image((100, 60), amp))
+        x1 = amp*45 + 1
+        hdu.header['DETSEC'] = f'[{x1}:{x1+44},1:100]'
+        hdus.append(hdu)
+    fits_filepath = str(tmp_path / 'LB.20230101.00000.00.fits')
+    fits.HDUList(hdus).writeto(fits_filepath)
+    assert fits.getheader(fits_filepath, 1)['BZERO'] == 32768
+
+    instr_obj = instr_lris.Lris('LRISBLUE', None, None, None, None)
+    instr_obj.create_jpg_from_fits(fits_filepath, str(tmp_path))
+
+    assert os.path.isfile(tmp_path / 'LB.20230101.00000.00.jpg')
+
+
+@pytest.mark.jpg
+def test_lris_blue_jpg_no_postscan_closes_file(tmp_path, monkeypatch):
+    '''
+    A blue frame without postscan columns skips the bias subtraction, and the file is closed after
+    '''
+    monkeypatch.setattr(instr_lris, 'fitsio', None)
+    opened = []
+    open_fits = instr_lris.Lris._open_fits
+    def track_open_fits(fits_filepath):
+        hdus = open_fits(fits_filepath)
+        opened.append(hdus)
+        return hdus
+    monkeypatch.setattr(instr_lris.Lris, '_open_fits', staticmethod(track_open_fits))
+
+    primary = fits.PrimaryHDU()
+    primary.header['INSTRUME'] = 'LRISBLUE'
+    primary.header['BINNING']  = '1,1'
+    primary.header['PRECOL']   = 5
+    primary.header['POSTPIX']  = 0
+    primary.header['PRELINE']  = 0
+    primary.header['POSTLINE'] = 0
+    hdus = [primary]
+    for amp in range(4):
+        hdu = fits.ImageHDU(make_uint16_image((100, 50), amp))
+        x1 = amp*45 + 1
+        hdu.header['DETSEC'] = f'[{x1}:{x1+44},1:100]'
+        hdus.append(hdu)
+    fits_filepath = str(tmp_path / 'LB.20230101.00000.00.fits')
+    fits.HDUList(hdus).writeto(fits_filepath)
+
+    instr_obj = instr_lris.Lris('LRISBLUE', None, None, None, None)
+    instr_obj.create_jpg_from_fits(fits_filepath, str(tmp_path))
+
+    assert os.path.isfile(tmp_path / 'LB.20230101.00000.00.jpg')
+    assert len(opened) == 1 and opened[0]._file.closed
@@ -0,0 +1,157 @@
+import os
+import sys
+import numpy as np
+from astropy.io import fits
+import pytest
+
+#import from parent dir
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parentdir)
+import instr_lris
+
+"""
+run lris tests with
+pytest -m lris
+"""
+
+def make_blue_frame(**primary_cards):
+    '''
+    Synthetic 4 amp LRIS blue frame: 100 x 60 pixel amps with 5 precol and 10 postpix columns,
+    amps 1/2 on CCD 1 and amps 3/4 on CCD 2
+    '''
+    primary = fits.PrimaryHDU()
+    primary.header['INSTRUME'] = 'LRISBLUE'
+    primary.header['BINNING']  = '1,1'
+    primary.header['PRECOL']   = 5
+    primary.header['POSTPIX']  = 10
+    for key, val in primary_cards.items():
+        primary.header[key] = val
+
+    rng = np.random.default_rng(1)
+    hdus = [primary]
+    for amp in range(4):
+        data = rng.integers(1000, 60000, size=(100, 60)).astype(np.uint16)
+        hdu = fits.ImageHDU(data)
+        hdu.header['CCDLOC'] = amp//2
+        hdu.header['AMPLOC'] = amp + 1
+        hdus.append(hdu)
+    return fits.HDUList(hdus)
+
+
+def make_lris(hdus):
+    '''Lris object for an in memory frame'''
+    instr_obj = instr_lris.Lris('LRISBLUE', None, None, None, None)
+    instr_obj.fits_hdu = hdus
+    instr_obj.get_nexten()
+    return instr_obj
+
+
+@pytest.mark.lris
+def test_null_value():
+    null_value = instr_lris.Lris._null_value
+    assert null_value('X', None) == 'null'
+    assert null_value('X', float('nan')) == 'null'
+    assert null_value('X', float('inf')) == 'null'
+    assert null_value('X', 1.5) == 1.5
+    assert null_value('X', 'RA---TAN') == 'RA---TAN'
+
+
+@pytest.mark.lris
+def test_set_wcs_writes_null_for_bad_values():
+    '''
+    A non-finite CRPIX and a missing ROTPOSN are written as null rather than raw
+    '''
+    hdus = make_blue_frame(OBSMODE='IMAGING', PONAME='LRIS', RA='10:00:00.0', DEC='+20:00:00.0')
+    for hdu in hdus[1:]:
+        hdu.header['CRPIX1'] = 1.0
+        hdu.header['CRPIX2'] = 1.0
+        hdu.header['CRVAL1'] = 0.0
+        hdu.header['CRVAL2'] = 0.0
+        hdu.header['CD1_1']  = 1.0
+        hdu.header['CD2_2']  = 1.0
+    #tiny CD1_1 overflows CRPIX1 to inf
+    hdus[1].header['CD1_1'] = 1e-320
+
+    instr_obj = make_lris(hdus)
+    assert instr_obj.set_wcs()
+
+    assert hdus[1].header['CRPIX1'] == 'null'
+    assert hdus[2].header['CRPIX1'] != 'null'
+    for hdu in hdus[1:]:
+        assert hdu.header['CROTA2'] == 'null'
+        assert hdu.header['CTYPE1'] == 'RA---TAN'
+        assert hdu.header['CRVAL1'] == pytest.approx(150.0)
+        assert hdu.header['CRVAL2'] == pytest.approx(20.0)
+
+
+@pytest.mark.lris
+@pytest.mark.parametrize('use_bottleneck', [True, False])
+def test_row_median(monkeypatch, use_bottleneck):
+    if not use_bottleneck:
+        monkeypatch.setattr(instr_lris, 'bn', None)
+    elif instr_lris.bn is None:
+        pytest.skip('bottleneck is not installed')
+
+    rng = np.random.default_rng(2)
+    for width in (1, 8, 9):
+        strip = rng.integers(0, 65535, size=(20, width)).astype('>u2')
+        median = instr_lris.Lris._row_median(strip)
+        assert median.shape == (20, 1)
+        assert np.array_equal(median[:,0], np.median(strip, axis=1))
+
+    assert instr_lris.Lris._row_median(np.zeros((20, 0), dtype=np.uint16)) is None
+
+
+@pytest.mark.lris
+@pytest.mark.parametrize('shape', [(15, 15), (15, 14), (6, 6), (1, 1)])
+def test_window_stats_match_numpy(shape):
+    '''
+    The single pass window stats agree with np.mean/np.std/np.median, including the rounded card strings
+    '''
+    rng = np.random.default_rng(3)
+    for i in range(200):
+        #big endian 16 bit, like the FITS data, around a bias level or a bright sky
+        level = rng.choice([1000, 30000, 60000])
+        window = (level + rng.normal(0, 50, size=shape)).clip(0, 65535).astype('>u2')
+
+        mean, std, median = instr_lris.Lris._window_stats(window)
+        expected = (np.mean(window), np.std(window), np.median(window))
+
+        #the sum of squares std differs from np.std by ~1e-9 at 60000 counts, far below the 0.01 card rounding
+        assert (mean, std, median) == pytest.approx(expected, rel=1e-12, abs=1e-6)
+        assert [str(round(x, 2)) for x in (mean, std, median)] == \
+               [str(round(float(x), 2)) for x in expected]
+
+
+@pytest.mark.lris
+def test_set_image_stats():
+    '''
+    IM*/PT* cards of a 4 amp blue frame: 7x7 windows at the center of the imaging and postscan columns
+    '''
+    hdus = make_blue_frame()
+    instr_obj = make_lris(hdus)
+    assert instr_obj.set_image_stats()
+
+    hdr0 = hdus[0].header
+    for ext, (ccd, amp) in enumerate([(1, 1), (1, 2), (2, 3), (2, 4)], start=1):
+        image = hdus[ext].data.astype(np.float64)
+        for prefix, window in (('IM', image[47:54, 24:31]), ('PT', image[47:54, 51:58])):
+            assert hdr0[f'{prefix}0{ccd}MN0{amp}'] == str(round(np.mean(window), 2))
+            assert hdr0[f'{prefix}0{ccd}SD0{amp}'] == str(round(np.std(window), 2))
+            assert hdr0[f'{prefix}0{ccd}MD0{amp}'] == str(round(np.median(window), 2))
+
+
+@pytest.mark.lris
+def test_set_image_stats_skips_ext_without_loc():
+    '''
+    An extension without CCDLOC or AMPLOC gets no cards, the others still do
+    '''
+    hdus = make_blue_frame()
+    del hdus[2].header['CCDLOC']
+    del hdus[4].header['AMPLOC']
+    instr_obj = make_lris(hdus)
+    assert instr_obj.set_image_stats()
+
+    hdr0 = hdus[0].header
+    assert 'IM01MN01' in hdr0 and 'PT02MD03' in hdr0
+    assert 'IM01MN02' not in hdr0 and 'IM02MN04' not in hdr0